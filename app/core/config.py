@@ -10,3 +10,8 @@ FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
 VERTEX_AI_PROJECT_ID = os.getenv("VERTEX_AI_PROJECT_ID", FIREBASE_PROJECT_ID)
 VERTEX_AI_LOCATION = os.getenv("VERTEX_AI_LOCATION", "us-central1")
 GEMINI_MODEL = "gemini-2.0-flash-001"
+
+# Worksheet RAG retrieval
+WORKSHEET_RAG_TOP_K = int(os.getenv("WORKSHEET_RAG_TOP_K", "5"))
+# Only enable once the corpus files carry subject/grade metadata, otherwise nothing matches
+WORKSHEET_RAG_METADATA_FILTER = os.getenv("WORKSHEET_RAG_METADATA_FILTER", "false").lower() == "true"
@@ -1,9 +1,13 @@
+from firebase_admin import firestore_async
 from app.core.firebase import initialize_firebase
 
 # Initialize Firestore (db)
 db = initialize_firebase()
 
+# Async client on the same Firebase app, for handlers that shouldn't block the event loop
+async_db = firestore_async.client()
+
 def add_user_to_firestore(user_id: str, user_data: dict):
     users_ref = db.collection("users").document(user_id)
     users_ref.set(user_data, merge=True)
-    return user_id
+    return user_id
\ No newline at end of file
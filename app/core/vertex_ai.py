@@ -149,6 +149,15 @@ def get_gemini_model() -> GenerativeModel:
         logger.error(f"Error initializing Gemini model: {e}")
         return GenerativeModel(GEMINI_MODEL)
 
+def _generation_config(temperature: float) -> dict:
+    """Generation settings shared by the sync and async content calls"""
+    return {
+        "temperature": temperature,
+        "top_p": 0.8,
+        "top_k": 40,
+        "max_output_tokens": 2048,
+    }
+
 def generate_content(prompt: str, temperature: float = 0.7) -> str:
     """Generate content using Vertex AI Gemini model"""
     try:
@@ -158,16 +167,9 @@ def generate_content(prompt: str, temperature: float = 0.7) -> str:
         
         model = get_gemini_model()
         
-        generation_config = {
-            "temperature": temperature,
-            "top_p": 0.8,
-            "top_k": 40,
-            "max_output_tokens": 2048,
-        }
-        
         response = model.generate_content(
             prompt,
-            generation_config=generation_config
+            generation_config=_generation_config(temperature)
         )
         
         return response.text
@@ -175,12 +177,26 @@ def generate_content(prompt: str, temperature: float = 0.7) -> str:
         logger.error(f"Error generating content: {e}")
         return f"I apologize, but I couldn't generate content at this time. Error: {str(e)}"
 
-def generate_educational_content(prompt: str, language: str = "English") -> str:
-    """Generate educational content with specific settings for teaching"""
+async def generate_content_async(prompt: str, temperature: float = 0.7) -> str:
+    """Generate content using Vertex AI Gemini model without blocking the event loop"""
     try:
         if not VERTEX_AI_AVAILABLE or not VERTEX_AI_INITIALIZED:
-            logger.error("Vertex AI not properly configured for educational content generation")
-            return """I apologize, but the AI content generation service is currently unavailable. 
+            logger.warning("Vertex AI not available, this should not happen in production")
+            return "Vertex AI is not properly configured. Please check your Google Cloud credentials and project settings."
+        
+        model = get_gemini_model()
+        
+        response = await model.generate_content_async(
+            prompt,
+            generation_config=_generation_config(temperature)
+        )
+        
+        return response.text
+    except Exception as e:
+        logger.error(f"Error generating content: {e}")
+        return f"I apologize, but I couldn't generate content at this time. Error: {str(e)}"
+
+_EDUCATIONAL_UNAVAILABLE_MESSAGE = """I apologize, but the AI content generation service is currently unavailable. 
 
 This appears to be a configuration issue with Google Cloud Vertex AI. To resolve this:
 
@@ -189,8 +205,10 @@ This appears to be a configuration issue with Google Cloud Vertex AI. To resolve
 3. Check that the service account has the necessary permissions
 
 For immediate assistance, please contact your system administrator or refer to the Google Cloud Vertex AI documentation."""
-        
-        educational_prompt = f"""You are an AI teaching assistant called "Sahayak" designed to help teachers in multi-grade, low-resource classrooms in India. 
+
+def _educational_prompt(prompt: str, language: str) -> str:
+    """Wrap a request in the Sahayak teaching-assistant instructions"""
+    return f"""You are an AI teaching assistant called "Sahayak" designed to help teachers in multi-grade, low-resource classrooms in India. 
 
 Language: {language}
 Cultural Context: Indian educational system, rural and semi-urban contexts
@@ -206,7 +224,26 @@ Request: {prompt}
 
 Please provide helpful educational content following these guidelines:"""
 
-        return generate_content(educational_prompt, temperature=0.6)
+def generate_educational_content(prompt: str, language: str = "English") -> str:
+    """Generate educational content with specific settings for teaching"""
+    try:
+        if not VERTEX_AI_AVAILABLE or not VERTEX_AI_INITIALIZED:
+            logger.error("Vertex AI not properly configured for educational content generation")
+            return _EDUCATIONAL_UNAVAILABLE_MESSAGE
+
+        return generate_content(_educational_prompt(prompt, language), temperature=0.6)
+    except Exception as e:
+        logger.error(f"Error generating educational content: {e}")
+        return f"I'm here to help create educational content, but I'm experiencing technical difficulties. Error: {str(e)}"
+
+async def generate_educational_content_async(prompt: str, language: str = "English") -> str:
+    """Async variant of generate_educational_content for use inside request handlers"""
+    try:
+        if not VERTEX_AI_AVAILABLE or not VERTEX_AI_INITIALIZED:
+            logger.error("Vertex AI not properly configured for educational content generation")
+            return _EDUCATIONAL_UNAVAILABLE_MESSAGE
+
+        return await generate_content_async(_educational_prompt(prompt, language), temperature=0.6)
     except Exception as e:
         logger.error(f"Error generating educational content: {e}")
         return f"I'm here to help create educational content, but I'm experiencing technical difficulties. Error: {str(e)}"
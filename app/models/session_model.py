@@ -1,14 +1,28 @@
-from pydantic import BaseModel, Field
-from typing import Optional, Dict, List, Any
+from pydantic import BaseModel, Field, PrivateAttr, field_validator, field_serializer
+from typing import Optional, Dict, List, Any, Deque
+from collections import deque
 from datetime import datetime
 from uuid import UUID
 
+# Number of most recent messages kept in memory per session; older ones live only in Firestore
+MAX_CACHED_MESSAGES = 100
+
 class UserMessage(BaseModel):
     """Represents a single message in a conversation"""
     timestamp: datetime
     content: str
     agent_type: str
     metadata: Optional[Dict[str, Any]] = {}
+    _iso_timestamp: str = PrivateAttr(default="")
+
+    def model_post_init(self, __context: Any) -> None:
+        # Messages are never mutated after creation, so format the timestamp once
+        self._iso_timestamp = self.timestamp.isoformat()
+
+    @field_serializer("timestamp", when_used="json")
+    def _serialize_timestamp(self, timestamp: datetime) -> str:
+        """Reuse the cached ISO string when rendering JSON"""
+        return self._iso_timestamp or timestamp.isoformat()
 
 class UserSession(BaseModel):
     """Represents a user session"""
@@ -16,9 +30,40 @@ class UserSession(BaseModel):
     user_id: str
     created_at: datetime
     last_active: datetime
-    messages: List[UserMessage] = []
+    messages: Deque[UserMessage] = Field(default_factory=lambda: deque(maxlen=MAX_CACHED_MESSAGES))
     language_preference: Optional[str] = "english"
     context: Dict[str, Any] = {}
+    _message_total: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any) -> None:
+        # Only the in-memory tail is known here; sessions loaded from storage set the full count
+        self._message_total = len(self.messages)
+
+    @property
+    def message_count(self) -> int:
+        """Total messages in the session, including those beyond the in-memory cap"""
+        return self._message_total
+
+    def add_message(self, message: UserMessage) -> None:
+        """Append a message to the in-memory history and count it towards the total"""
+        self.messages.append(message)
+        self._message_total += 1
+
+    def clear_messages(self) -> None:
+        """Drop the whole history, in memory and in the total"""
+        self.messages.clear()
+        self._message_total = 0
+
+    @field_validator("messages", mode="after")
+    @classmethod
+    def _cap_messages(cls, messages: Deque[UserMessage]) -> Deque[UserMessage]:
+        """Bound the in-memory history to the most recent messages"""
+        return deque(messages, maxlen=MAX_CACHED_MESSAGES)
+
+    @field_serializer("messages", mode="wrap")
+    def _serialize_messages(self, messages: Deque[UserMessage], handler) -> List[Any]:
+        """Dump messages as a plain list (Firestore does not accept deques)"""
+        return list(handler(messages))
 
 class SessionResponse(BaseModel):
     """Response model for session operations"""
@@ -9,6 +9,19 @@ class WorksheetType(str, Enum):
     SHORT_ANSWERS = "short_answers"
 
 
+class WorksheetQuestion(BaseModel):
+    """A single generated worksheet question, used as part of the model's response schema."""
+    question: str = Field(..., description="Question text, with a blank (____) for fill-in-the-blanks")
+    options: List[str] = Field(default_factory=list, description="Answer options for multiple choice, without A)/B) labels; empty otherwise")
+    answer: str = Field(..., description="Correct answer for the answer key")
+
+
+class WorksheetContent(BaseModel):
+    """Structured worksheet content returned by the model."""
+    title: str = Field("", description="Worksheet title")
+    questions: List[WorksheetQuestion] = Field(..., description="Worksheet questions in order")
+
+
 class WorksheetRequest(BaseModel):
     """Request model for worksheet generation."""
     subject: str = Field(..., description="Subject for the worksheet (e.g., Math, Science, History)")
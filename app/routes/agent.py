@@ -217,7 +217,7 @@ async def generate_visual_aid(
         # If user_id is provided, validate it
         if user_id:
             try:
-                session = session_service.get_session(user_id)
+                session = await session_service.get_session_async(user_id)
             except Exception as session_error:
                 logger.warning(f"Invalid user_id for session: {session_error}")
                 raise HTTPException(
@@ -243,7 +243,7 @@ async def generate_visual_aid(
         )
         
         # Generate the visual aid
-        response = visual_aids_service.generate_visual_aid(request, user_id=user_id)
+        response = await visual_aids_service.generate_visual_aid_async(request, user_id=user_id)
         return response
         
     except HTTPException:
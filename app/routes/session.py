@@ -15,7 +15,7 @@ async def get_user_history(user_id: str, limit: Optional[int] = Query(10, ge=1,
     """Get user message history"""
     try:
         # Check if the user exists (for non-anonymous users)
-        if user_id != "anonymous" and not session_service.user_exists(user_id):
+        if user_id != "anonymous" and not await session_service.user_exists_async(user_id):
             raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
             
         messages = session_service.get_user_history(user_id, limit)
@@ -31,7 +31,7 @@ async def clear_user_session(user_id: str):
     """Clear a user's session history"""
     try:
         # Check if the user exists (for non-anonymous users)
-        if user_id != "anonymous" and not session_service.user_exists(user_id):
+        if user_id != "anonymous" and not await session_service.user_exists_async(user_id):
             raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
             
         response = session_service.clear_session(user_id)
@@ -49,7 +49,7 @@ async def get_session_info(user_id: str):
     """Get information about a user's session"""
     try:
         # Check if the user exists (for non-anonymous users)
-        if user_id != "anonymous" and not session_service.user_exists(user_id):
+        if user_id != "anonymous" and not await session_service.user_exists_async(user_id):
             raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
             
         return session_service.get_session_details(user_id)
@@ -64,7 +64,7 @@ async def get_all_sessions(user_id: str):
     """Get all session IDs for a user"""
     try:
         # Check if the user exists (for non-anonymous users)
-        if user_id != "anonymous" and not session_service.user_exists(user_id):
+        if user_id != "anonymous" and not await session_service.user_exists_async(user_id):
             raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
             
         sessions = session_service.get_all_sessions_for_user(user_id)
@@ -87,7 +87,7 @@ async def get_session_by_id(request: SessionHistoryRequest):
             raise HTTPException(status_code=400, detail="Session ID and User ID are required")
             
         # Check if the user exists (for non-anonymous users)
-        if request.user_id != "anonymous" and not session_service.user_exists(request.user_id):
+        if request.user_id != "anonymous" and not await session_service.user_exists_async(request.user_id):
             raise HTTPException(status_code=404, detail=f"User with ID {request.user_id} not found")
         
         session_history = session_service.get_session_history(
@@ -122,7 +122,7 @@ async def get_session_by_id_path(
     """
     try:
         # Check if the user exists (for non-anonymous users)
-        if user_id != "anonymous" and not session_service.user_exists(user_id):
+        if user_id != "anonymous" and not await session_service.user_exists_async(user_id):
             raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
             
         session_history = session_service.get_session_history(
@@ -148,14 +148,14 @@ async def get_session_by_id_path(
 async def get_session_info_old_version(user_id: str):
     """Get information about a user's session (old version, kept for compatibility)"""
     try:
-        session = session_service.get_session(user_id)
+        session = await session_service.get_session_async(user_id)
         return {
             "session_id": session.session_id,
             "user_id": session.user_id,
             "created_at": session.created_at,
             "last_active": session.last_active,
             "language_preference": session.language_preference,
-            "message_count": len(session.messages),
+            "message_count": session.message_count,
             "context_keys": list(session.context.keys()) if session.context else []
         }
     except Exception as e:
@@ -7,7 +7,7 @@ router = APIRouter()
 @router.post("/register")
 async def register_user_route(user: UserRegisterRequest):
     try:
-        result = register_user(user)
+        result = await register_user(user)
         return {"status": "success", "user_id": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
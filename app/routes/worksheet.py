@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException, Body
+from fastapi.responses import FileResponse
 from typing import Dict, Any, Optional
 from datetime import datetime
+from urllib.parse import quote
+import os
 
 from app.models.worksheet_model import WorksheetRequest, WorksheetResponse, WorksheetType
 from app.services.worksheet_generator_service import worksheet_generator_service
@@ -178,6 +181,42 @@ async def generate_worksheet_json(
         logger.error(f"Error generating worksheet: {e}")
         raise HTTPException(status_code=500, detail=f"Worksheet generation failed: {str(e)}")
 
+@router.post("/generate-pdf", response_class=FileResponse)
+async def generate_worksheet_pdf(
+    request: WorksheetRequest = Body(...),
+    user_id: Optional[str] = Body(None, description="User ID for session tracking")
+):
+    """
+    Generate an educational worksheet and stream the PDF back directly.
+    
+    Accepts the same body as **/generate**, but responds with the PDF itself
+    instead of a URL, saving clients a second round-trip to download it.
+    The worksheet metadata is returned in the `X-Worksheet-Title` and
+    `X-Worksheet-Url` headers.
+    """
+    try:
+        result, pdf_path = await worksheet_generator_service.generate_worksheet_file(
+            request=request,
+            user_id=request.user_id or user_id
+        )
+        
+        return FileResponse(
+            pdf_path,
+            media_type="application/pdf",
+            filename=os.path.basename(pdf_path),
+            headers={
+                "X-Worksheet-Title": quote(result.title),
+                "X-Worksheet-Url": result.pdf_url
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error generating worksheet PDF: {e}")
+        raise HTTPException(status_code=500, detail=f"Worksheet generation failed: {str(e)}")
+
+
 @router.get("/types", response_model=Dict[str, str])
 async def get_worksheet_types():
     """
@@ -191,7 +191,7 @@ class HyperLocalContentService:
                     session_id=user_session.session_id,
                     user_id=user_session.user_id,
                     language_preference=user_session.language_preference,
-                    message_count=len(user_session.messages),
+                    message_count=user_session.message_count,
                     context_keys=list(user_session.context.keys()) if user_session.context else [],
                     last_active=user_session.last_active.isoformat() if isinstance(user_session.last_active, datetime) else str(user_session.last_active)
                 )
@@ -231,7 +231,7 @@ class HyperLocalContentService:
                         session_id=user_session.session_id,
                         user_id=user_session.user_id,
                         language_preference=user_session.language_preference,
-                        message_count=len(user_session.messages),
+                        message_count=user_session.message_count,
                         context_keys=list(user_session.context.keys()) if user_session.context else [],
                         last_active=user_session.last_active.isoformat() if isinstance(user_session.last_active, datetime) else str(user_session.last_active)
                     )
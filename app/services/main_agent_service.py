@@ -125,7 +125,7 @@ class MainAgentService:
                 session_id=session.session_id,
                 user_id=session.user_id,
                 language_preference=session.language_preference,
-                message_count=len(session.messages),
+                message_count=session.message_count,
                 context_keys=list(session.context.keys()) if session.context else [],
                 last_active=session.last_active.isoformat() if isinstance(session.last_active, datetime) else str(session.last_active)
             )
@@ -204,7 +204,7 @@ class MainAgentService:
                         session_id=user_session.session_id,
                         user_id=user_session.user_id,
                         language_preference=user_session.language_preference,
-                        message_count=len(user_session.messages),
+                        message_count=user_session.message_count,
                         context_keys=list(user_session.context.keys()) if user_session.context else [],
                         last_active=user_session.last_active.isoformat() if isinstance(user_session.last_active, datetime) else str(user_session.last_active)
                     )
@@ -239,7 +239,7 @@ class MainAgentService:
                             session_id=user_session.session_id,
                             user_id=user_session.user_id,
                             language_preference=user_session.language_preference,
-                            message_count=len(user_session.messages),
+                            message_count=user_session.message_count,
                             context_keys=list(user_session.context.keys()) if user_session.context else [],
                             last_active=user_session.last_active.isoformat() if isinstance(user_session.last_active, datetime) else str(user_session.last_active)
                         )
@@ -1,10 +1,29 @@
+import asyncio
+import itertools
+import threading
 import uuid
+from collections import deque
 from datetime import datetime
 from typing import Dict, Optional, List, Any
-from app.models.session_model import UserSession, UserMessage, SessionResponse, SessionHistoryResponse, SessionDetailsResponse
-from app.core.firestore import db
+from cachetools import TTLCache
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from app.models.session_model import MAX_CACHED_MESSAGES, UserSession, UserMessage, SessionResponse, SessionHistoryResponse, SessionDetailsResponse
+from app.core.firestore import db, async_db
 from app.utils.logger import logger
 
+_LOCK_STRIPES = 64  # Must be a power of two
+
+def _to_dt(value: Any) -> Any:
+    """Normalize a stored timestamp to a datetime.
+    
+    Firestore returns native timestamps as DatetimeWithNanoseconds (a datetime
+    subclass); ISO strings only appear on documents written by older versions.
+    """
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
 class SessionService:
     """Service for managing user sessions"""
     
@@ -12,7 +31,13 @@ class SessionService:
         """Initialize the session service"""
         self.sessions_collection = db.collection("sessions")
         self.users_collection = db.collection("users")
+        self.async_sessions_collection = async_db.collection("sessions")
+        self.async_users_collection = async_db.collection("users")
         self.active_sessions: Dict[str, UserSession] = {}  # In-memory cache for active sessions
+        self._user_to_session: Dict[str, str] = {}  # user_id -> session_id index into active_sessions
+        self._user_exists_cache: TTLCache = TTLCache(maxsize=50_000, ttl=300)  # Positive and negative existence results
+        self._user_exists_lock = threading.Lock()  # cachetools caches are not thread-safe
+        self._stripes = [threading.Lock() for _ in range(_LOCK_STRIPES)]  # Striped per-user locks for cache misses
         
     def user_exists(self, user_id: str) -> bool:
         """
@@ -27,13 +52,101 @@ class SessionService:
         if not user_id:
             return False
             
+        with self._user_exists_lock:
+            cached = self._user_exists_cache.get(user_id)
+        if cached is not None:
+            return cached
+            
         try:
-            user_doc = self.users_collection.document(user_id).get()
+            # Only existence is needed, so skip fetching the document body
+            exists = self.users_collection.document(user_id).get(field_paths=[]).exists
+            with self._user_exists_lock:
+                self._user_exists_cache[user_id] = exists
+            return exists
+        except Exception as e:
+            logger.error(f"Error checking if user {user_id} exists: {e}")
+            return False
+    
+    async def user_exists_async(self, user_id: str) -> bool:
+        """
+        Async variant of user_exists, sharing the same result cache
+        
+        Args:
+            user_id: The ID of the user to check
+            
+        Returns:
+            bool: True if the user exists, False otherwise
+        """
+        if not user_id:
+            return False
+            
+        with self._user_exists_lock:
+            cached = self._user_exists_cache.get(user_id)
+        if cached is not None:
+            return cached
+            
+        try:
+            user_doc = await self.async_users_collection.document(user_id).get(field_paths=[])
+            with self._user_exists_lock:
+                self._user_exists_cache[user_id] = user_doc.exists
             return user_doc.exists
         except Exception as e:
             logger.error(f"Error checking if user {user_id} exists: {e}")
             return False
     
+    def _lock_for(self, user_id: str) -> threading.Lock:
+        """Get the lock stripe guarding a user's session cache entry"""
+        return self._stripes[hash(user_id) & (_LOCK_STRIPES - 1)]
+    
+    def _get_cached_session(self, user_id: str) -> Optional[UserSession]:
+        """Look up a user's session in the in-memory cache"""
+        session_id = self._user_to_session.get(user_id)
+        return self.active_sessions.get(session_id) if session_id else None
+    
+    def _cache_session(self, session: UserSession) -> None:
+        """Cache a session in memory and index it by user ID (first cached session wins)"""
+        self.active_sessions[session.session_id] = session
+        self._user_to_session.setdefault(session.user_id, session.session_id)
+    
+    def _session_from_doc(self, session_id: str, session_data: Dict[str, Any]) -> UserSession:
+        """
+        Build a UserSession from a Firestore document
+        
+        Args:
+            session_id: The ID of the session document
+            session_data: The document data as returned by to_dict()
+            
+        Returns:
+            UserSession: The hydrated session
+        """
+        # Documents are written by this service, so skip validation; only the cached tail is built
+        stored_messages = session_data.get("messages", [])
+        messages = deque(
+            (
+                UserMessage.model_construct(
+                    timestamp=_to_dt(msg.get("timestamp")),
+                    content=msg.get("content"),
+                    agent_type=msg.get("agent_type"),
+                    metadata=msg.get("metadata") or {}
+                )
+                for msg in stored_messages[-MAX_CACHED_MESSAGES:]
+            ),
+            maxlen=MAX_CACHED_MESSAGES
+        )
+        
+        session = UserSession.model_construct(
+            session_id=session_id,
+            user_id=session_data.get("user_id"),
+            created_at=_to_dt(session_data.get("created_at")),
+            last_active=_to_dt(session_data.get("last_active")),
+            messages=messages,
+            language_preference=session_data.get("language_preference", "english"),
+            context=session_data.get("context", {})
+        )
+        # Count every stored message, not just the cached tail
+        session._message_total = len(stored_messages)
+        return session
+    
     def get_session(self, user_id: str) -> UserSession:
         """
         Get a session for a user. If no session exists, create one.
@@ -51,49 +164,95 @@ class SessionService:
         if user_id != "anonymous" and not self.user_exists(user_id):
             raise ValueError(f"User with ID {user_id} does not exist")
             
-        try:
-            # Check if session exists in memory cache
-            for session in self.active_sessions.values():
-                if session.user_id == user_id:
-                    return session
-            
-            # Check if session exists in Firestore
-            sessions_ref = self.sessions_collection.where("user_id", "==", user_id).limit(1).stream()
+        # Check if session exists in memory cache
+        session = self._get_cached_session(user_id)
+        if session:
+            return session
             
-            session_docs = list(sessions_ref)
-            if session_docs:
-                # Session exists in Firestore, retrieve it
-                session_data = session_docs[0].to_dict()
-                session_id = session_docs[0].id
-                
-                # Convert message timestamps
-                messages = []
-                for msg in session_data.get("messages", []):
-                    if isinstance(msg.get("timestamp"), str):
-                        msg["timestamp"] = datetime.fromisoformat(msg.get("timestamp"))
-                    messages.append(UserMessage(**msg))
+        # Serialize cache misses per user so concurrent requests don't each create a session
+        with self._lock_for(user_id):
+            try:
+                # Another request may have loaded the session while we waited for the lock
+                session = self._get_cached_session(user_id)
+                if session:
+                    return session
                 
-                # Create session object
-                session = UserSession(
-                    session_id=session_id,
-                    user_id=session_data.get("user_id"),
-                    created_at=datetime.fromisoformat(session_data.get("created_at")) if isinstance(session_data.get("created_at"), str) else session_data.get("created_at"),
-                    last_active=datetime.fromisoformat(session_data.get("last_active")) if isinstance(session_data.get("last_active"), str) else session_data.get("last_active"),
-                    messages=messages,
-                    language_preference=session_data.get("language_preference", "english"),
-                    context=session_data.get("context", {})
-                )
+                # Check if session exists in Firestore
+                sessions_ref = self.sessions_collection.where("user_id", "==", user_id).limit(1).stream()
                 
-                # Cache the session
-                self.active_sessions[session_id] = session
-                return session
-            else:
-                # No session exists, create a new one
+                session_docs = list(sessions_ref)
+                if session_docs:
+                    # Session exists in Firestore, retrieve it
+                    session = self._session_from_doc(session_docs[0].id, session_docs[0].to_dict())
+                    
+                    # Cache the session
+                    self._cache_session(session)
+                    return session
+                else:
+                    # No session exists, create a new one
+                    return self.create_session(user_id)
+                    
+            except Exception as e:
+                logger.error(f"Error getting session for user {user_id}: {e}")
+                # If there's an error, create a new session as fallback
                 return self.create_session(user_id)
-                
+    
+    async def get_session_async(self, user_id: str) -> UserSession:
+        """
+        Async variant of get_session. Cache hits and Firestore reads don't block
+        the event loop; caching or creating the session runs under the per-user
+        lock in a worker thread.
+        
+        Args:
+            user_id: The ID of the user
+            
+        Returns:
+            UserSession: The user's session
+        """
+        if not user_id:
+            raise ValueError("User ID cannot be empty")
+            
+        # Skip user validation for anonymous users
+        if user_id != "anonymous" and not await self.user_exists_async(user_id):
+            raise ValueError(f"User with ID {user_id} does not exist")
+            
+        # Check if session exists in memory cache
+        session = self._get_cached_session(user_id)
+        if session:
+            return session
+            
+        session = None
+        try:
+            # Check if session exists in Firestore
+            query = self.async_sessions_collection.where("user_id", "==", user_id).limit(1)
+            async for session_doc in query.stream():
+                session = self._session_from_doc(session_doc.id, session_doc.to_dict())
+                break
         except Exception as e:
             logger.error(f"Error getting session for user {user_id}: {e}")
-            # If there's an error, create a new session as fallback
+            
+        # Cache the loaded session, or create one if none exists (or the lookup failed)
+        return await asyncio.to_thread(self._cache_or_create_session, user_id, session)
+    
+    def _cache_or_create_session(self, user_id: str, session: Optional[UserSession]) -> UserSession:
+        """
+        Under the per-user lock, return the cached session if another request
+        got there first, otherwise cache the given session or create a new one
+        
+        Args:
+            user_id: The ID of the user
+            session: The session loaded from Firestore, or None if there was none
+            
+        Returns:
+            UserSession: The user's session
+        """
+        with self._lock_for(user_id):
+            cached = self._get_cached_session(user_id)
+            if cached:
+                return cached
+            if session is not None:
+                self._cache_session(session)
+                return session
             return self.create_session(user_id)
     
     def create_session(self, user_id: str) -> UserSession:
@@ -121,16 +280,13 @@ class SessionService:
                 context={}
             )
             
-            # Store in Firestore
-            session_dict = session.dict()
-            # Convert datetime objects to strings for Firestore
-            session_dict["created_at"] = session_dict["created_at"].isoformat()
-            session_dict["last_active"] = session_dict["last_active"].isoformat()
+            # Store in Firestore (datetimes are stored as native Timestamps)
+            session_dict = session.model_dump()
             
             self.sessions_collection.document(session_id).set(session_dict)
             
             # Cache the session
-            self.active_sessions[session_id] = session
+            self._cache_session(session)
             
             logger.info(f"Created new session {session_id} for user {user_id}")
             return session
@@ -151,7 +307,7 @@ class SessionService:
                 context={}
             )
             
-            self.active_sessions[session_id] = session
+            self._cache_session(session)
             return session
     
     def update_session_context(self, session_id: str, context_update: Dict[str, Any]) -> Optional[UserSession]:
@@ -196,7 +352,7 @@ class SessionService:
             # Update in Firestore
             updates = {
                 "context": session.context,
-                "last_active": session.last_active.isoformat()
+                "last_active": session.last_active
             }
             
             self.sessions_collection.document(session_id).update(updates)
@@ -230,29 +386,85 @@ class SessionService:
             session = self.get_session(user_id)
             
             # Create message
+            now = datetime.now()
             message = UserMessage(
-                timestamp=datetime.now(),
+                timestamp=now,
                 content=content,
                 agent_type=agent_type,
                 metadata=metadata or {}
             )
             
             # Add to session
-            session.messages.append(message)
-            session.last_active = datetime.now()
+            session.add_message(message)
+            session.last_active = now
             
-            # Update Firestore
+            # Update Firestore by appending only the new message
             try:
-                session_dict = session.dict()
-                
-                # Convert datetime objects to strings for Firestore
-                session_dict["last_active"] = session_dict["last_active"].isoformat()
-                
-                # Convert message timestamps
-                for msg in session_dict["messages"]:
-                    msg["timestamp"] = msg["timestamp"].isoformat()
-                
-                self.sessions_collection.document(session.session_id).set(session_dict)
+                session_ref = self.sessions_collection.document(session.session_id)
+                try:
+                    session_ref.update({
+                        "messages": firestore.ArrayUnion([message.model_dump()]),
+                        "last_active": now
+                    })
+                except NotFound:
+                    # Memory-only session (e.g. Firestore was down at creation), write it in full
+                    session_ref.set(session.model_dump())
+                logger.info(f"Added message to session {session.session_id}")
+            except Exception as e:
+                logger.error(f"Error updating session in Firestore: {e}")
+                # Continue with in-memory session even if Firestore update fails
+            
+            return session.session_id
+            
+        except Exception as e:
+            logger.error(f"Error adding message for user {user_id}: {e}")
+            return ""
+    
+    async def add_message_async(self, user_id: str, content: str, agent_type: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Async variant of add_message
+        
+        Args:
+            user_id: The ID of the user
+            content: The message content
+            agent_type: The type of agent sending the message
+            metadata: Optional metadata for the message
+            
+        Returns:
+            str: The session ID if successful, empty string otherwise
+        """
+        if not user_id:
+            logger.error("Cannot add message: User ID is required")
+            return ""
+            
+        try:
+            # Get or create session
+            session = await self.get_session_async(user_id)
+            
+            # Create message
+            now = datetime.now()
+            message = UserMessage(
+                timestamp=now,
+                content=content,
+                agent_type=agent_type,
+                metadata=metadata or {}
+            )
+            
+            # Add to session
+            session.add_message(message)
+            session.last_active = now
+            
+            # Update Firestore by appending only the new message
+            try:
+                session_ref = self.async_sessions_collection.document(session.session_id)
+                try:
+                    await session_ref.update({
+                        "messages": firestore.ArrayUnion([message.model_dump()]),
+                        "last_active": now
+                    })
+                except NotFound:
+                    # Memory-only session (e.g. Firestore was down at creation), write it in full
+                    await session_ref.set(session.model_dump())
                 logger.info(f"Added message to session {session.session_id}")
             except Exception as e:
                 logger.error(f"Error updating session in Firestore: {e}")
@@ -279,7 +491,7 @@ class SessionService:
             session = self.get_session(user_id)
             
             # Return most recent messages first, up to the limit
-            return session.messages[-limit:] if len(session.messages) > limit else session.messages
+            return list(itertools.islice(session.messages, max(0, len(session.messages) - limit), None))
             
         except Exception as e:
             logger.error(f"Error getting message history for user {user_id}: {e}")
@@ -302,8 +514,8 @@ class SessionService:
             
         try:
             # Check if session exists in memory cache
-            if session_id in self.active_sessions:
-                session = self.active_sessions[session_id]
+            session = self.active_sessions.get(session_id)
+            if session is not None:
                 # Validate that the session belongs to the user
                 if session.user_id == user_id:
                     return session
@@ -322,26 +534,10 @@ class SessionService:
                     logger.warning(f"Session {session_id} does not belong to user {user_id}")
                     return None
                 
-                # Convert message timestamps
-                messages = []
-                for msg in session_data.get("messages", []):
-                    if isinstance(msg.get("timestamp"), str):
-                        msg["timestamp"] = datetime.fromisoformat(msg.get("timestamp"))
-                    messages.append(UserMessage(**msg))
-                
-                # Create session object
-                session = UserSession(
-                    session_id=session_id,
-                    user_id=session_data.get("user_id"),
-                    created_at=datetime.fromisoformat(session_data.get("created_at")) if isinstance(session_data.get("created_at"), str) else session_data.get("created_at"),
-                    last_active=datetime.fromisoformat(session_data.get("last_active")) if isinstance(session_data.get("last_active"), str) else session_data.get("last_active"),
-                    messages=messages,
-                    language_preference=session_data.get("language_preference", "english"),
-                    context=session_data.get("context", {})
-                )
+                session = self._session_from_doc(session_id, session_data)
                 
                 # Cache the session
-                self.active_sessions[session_id] = session
+                self._cache_session(session)
                 return session
             else:
                 logger.warning(f"Session {session_id} not found")
@@ -373,16 +569,16 @@ class SessionService:
             session = self.get_session(user_id)
             
             # Clear messages
-            session.messages = []
+            session.clear_messages()
             
-            # Update Firestore
+            session.last_active = datetime.now()
+            
+            # Update Firestore, touching only the cleared fields (server clock is authoritative)
             try:
-                session_dict = session.dict()
-                # Convert datetime objects to strings for Firestore
-                session_dict["created_at"] = session_dict["created_at"].isoformat()
-                session_dict["last_active"] = datetime.now().isoformat()
-                
-                self.sessions_collection.document(session.session_id).set(session_dict)
+                self.sessions_collection.document(session.session_id).update({
+                    "messages": [],
+                    "last_active": firestore.SERVER_TIMESTAMP
+                })
             except Exception as e:
                 logger.error(f"Error clearing session in Firestore: {e}")
             
@@ -421,7 +617,7 @@ class SessionService:
                 return None
                 
             # Create the response
-            messages = session.messages[-limit:] if len(session.messages) > limit else session.messages
+            messages = list(itertools.islice(session.messages, max(0, len(session.messages) - limit), None))
             
             return SessionHistoryResponse(
                 status="success",
@@ -430,7 +626,7 @@ class SessionService:
                 created_at=session.created_at.isoformat() if isinstance(session.created_at, datetime) else str(session.created_at),
                 last_active=session.last_active.isoformat() if isinstance(session.last_active, datetime) else str(session.last_active),
                 language_preference=session.language_preference,
-                message_count=len(session.messages),
+                message_count=session.message_count,
                 messages=messages,
                 context_keys=list(session.context.keys()) if session.context else []
             )
@@ -466,6 +662,44 @@ class SessionService:
             logger.error(f"Error getting all sessions for user {user_id}: {e}")
             return []
     
+    def get_sessions_bulk(self, session_ids: List[str], user_id: str) -> List[UserSession]:
+        """
+        Get several sessions in one Firestore round-trip, keeping only those owned by the user
+        
+        Args:
+            session_ids: The IDs of the sessions to retrieve
+            user_id: The ID of the user who should own the sessions
+            
+        Returns:
+            List[UserSession]: The sessions found, in the order requested
+        """
+        if not session_ids or not user_id:
+            return []
+            
+        try:
+            # Serve cached sessions from memory and batch the rest into a single get_all
+            found: Dict[str, UserSession] = {
+                sid: self.active_sessions[sid] for sid in session_ids if sid in self.active_sessions
+            }
+            refs = [self.sessions_collection.document(sid) for sid in session_ids if sid not in found]
+            
+            if refs:
+                for snapshot in db.get_all(refs):
+                    if not snapshot.exists:
+                        continue
+                    session_data = snapshot.to_dict()
+                    if session_data.get("user_id") != user_id:
+                        continue
+                    session = self._session_from_doc(snapshot.id, session_data)
+                    self._cache_session(session)
+                    found[snapshot.id] = session
+            
+            return [found[sid] for sid in session_ids if sid in found and found[sid].user_id == user_id]
+            
+        except Exception as e:
+            logger.error(f"Error getting sessions in bulk for user {user_id}: {e}")
+            return []
+    
     def get_session_details(self, user_id: str) -> SessionDetailsResponse:
         """
         Get session details without messages
@@ -486,7 +720,7 @@ class SessionService:
                 created_at=session.created_at.isoformat() if isinstance(session.created_at, datetime) else str(session.created_at),
                 last_active=session.last_active.isoformat() if isinstance(session.last_active, datetime) else str(session.last_active),
                 language_preference=session.language_preference,
-                message_count=len(session.messages),
+                message_count=session.message_count,
                 context_keys=list(session.context.keys()) if session.context else []
             )
             
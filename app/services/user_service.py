@@ -1,9 +1,10 @@
+import asyncio
 import uuid
 from app.models.user_model import UserRegisterRequest
 from app.core.firestore import add_user_to_firestore
 
-def register_user(user: UserRegisterRequest):
-    user_id = str(uuid.uuid4())
+async def register_user(user: UserRegisterRequest):
+    user_id = uuid.uuid4().hex
     user_data = {
         "uid" : user.uid,
         "full_name": user.full_name,
@@ -11,4 +12,5 @@ def register_user(user: UserRegisterRequest):
         "profile_image": user.profile_image,
         "user_id": user_id,
     }
-    return add_user_to_firestore(user_id, user_data)
+    # The Firestore write is blocking, keep it off the event loop
+    return await asyncio.to_thread(add_user_to_firestore, user_id, user_data)
\ No newline at end of file
@@ -2,18 +2,273 @@ from app.models.agent_model import (
     VisualAidRequest, VisualAidResponse, AgentType, Language, VisualAidType, 
     VisualAid, Subject, SessionInfo
 )
-from app.core.vertex_ai import generate_educational_content, generate_image
+from app.core.vertex_ai import generate_educational_content_async, generate_image
 from app.utils.logger import logger
 from app.services.session_service import session_service
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime
+from functools import lru_cache
+from types import MappingProxyType
+from cachetools import LRUCache
+import asyncio
+import hashlib
 import json
+import os
 import re
 import random
+import shutil
+import threading
+import time
+
+# Section headings of the structured LLM response, matched in a single pass
+_SECTIONS_RE = re.compile(
+    r"(?P<head>DRAWING TITLE|MATERIALS NEEDED|STEP-BY-STEP DRAWING INSTRUCTIONS|KEY LABELS|TEACHING TIPS)\s*:",
+    re.IGNORECASE
+)
+# Leading number or bullet marker of a list line
+_BULLET_PREFIX = re.compile(r'^\s*(?:\d+[.)]|[-*•])\s*')
+
+# Prompt guidance and drawing time (minutes) per complexity level
+_COMPLEXITY_GUIDE = MappingProxyType({
+    "simple": "Use minimal elements, focus on core concepts only, 3-5 components max",
+    "medium": "Include main concepts with some supporting details, 5-8 components",
+    "detailed": "Include comprehensive details while keeping it drawable, 8-12 components max"
+})
+
+_COMPLEXITY_TIMES = MappingProxyType({
+    "simple": "2-3",
+    "medium": "4-6",
+    "detailed": "7-10"
+})
+
+# Words that usually precede the topic in a description
+_TOPIC_MARKERS = frozenset({"about", "on", "for", "of", "regarding"})
+
+# Word boundaries in topics and template keys
+_KEY_SEPARATORS = re.compile(r'[\s_]+')
+
+# Grade numbers in a grade range string, and the grades in each school level
+_GRADE_RE = re.compile(r'\d+')
+_ELEMENTARY_GRADES = frozenset(range(1, 6))
+_MIDDLE_GRADES = frozenset(range(6, 9))
+_HIGH_GRADES = frozenset(range(9, 13))
+
+# Contextual frameworks based on subject areas, formatted with the topic
+_SCIENCE_CONTEXTS = (
+    "a conceptual model showing the key processes involved in {topic}",
+    "a visual representation of the structure and components of {topic}",
+    "an illustrated explanation of how {topic} works and its significance",
+    "a comparative visualization showing different aspects of {topic}",
+)
+
+_MATH_CONTEXTS = (
+    "a visual representation of {topic} showing mathematical relationships",
+    "an illustrated explanation of the {topic} concept with examples",
+    "a step-by-step visual guide to understanding {topic}",
+    "a conceptual model demonstrating how {topic} applies in different situations",
+)
+
+_SOCIAL_CONTEXTS = (
+    "a visual overview of key concepts in {topic}",
+    "an illustrated timeline or process diagram explaining {topic}",
+    "a conceptual map showing relationships between aspects of {topic}",
+    "a visual representation comparing different perspectives on {topic}",
+)
+
+# Pedagogical approaches by grade level
+_APPROACHES_ELEMENTARY = (
+    "Concrete visual representations with simple, clear labels",
+    "Engaging, colorful illustrations that capture attention and interest",
+    "Simple visual storytelling to make concepts accessible",
+    "Direct visual representation of concrete concepts",
+)
+
+_APPROACHES_MIDDLE = (
+    "Balanced concrete and abstract representations",
+    "Visual analogies connecting new concepts to familiar ideas",
+    "Clear organizational structures showing relationships between concepts",
+    "Scaffolded visual explanations building conceptual understanding",
+)
+
+_APPROACHES_HIGH = (
+    "Abstract representations emphasizing conceptual relationships",
+    "Sophisticated visual models showing multiple layers of understanding",
+    "Visual synthesis of complex ideas and their applications",
+    "Critical analysis frameworks presented visually",
+)
+
+_APPROACHES_GENERAL = (
+    "Clear visual representation appropriate for diverse learners",
+    "Balanced concrete and abstract visual elements",
+    "Structured visual framework highlighting key concepts",
+)
+
+# Base style elements that apply to all educational visuals
+_BASE_STYLE = (
+    "Clean, professional educational design with clear purpose",
+    "Thoughtful layout with proper spacing and visual hierarchy",
+    "Appropriate use of color to highlight important concepts",
+    "Clear labels integrated with visual elements",
+    "White background for maximum clarity and focus",
+)
+
+# Style elements specific to each visual type
+_TYPE_SPECIFIC_STYLES = {
+    "line_drawing": (
+        "Precise, confident line work with varying line weights",
+        "Minimal shading only where necessary for clarity",
+        "Clean contours defining all important elements",
+    ),
+    "chart": (
+        "Clear axes with appropriate scales and labels",
+        "Distinct data representations with strong visual contrast",
+        "Legend explaining all visual elements used",
+    ),
+    "diagram": (
+        "Precise illustration of components with clear boundaries",
+        "Strategic use of cutaways or cross-sections where helpful",
+        "Visual emphasis on key structural relationships",
+    ),
+    "flowchart": (
+        "Clear directional indicators showing process flow",
+        "Distinct shapes for different types of steps or decisions",
+        "Logical layout that guides the eye through the process",
+    ),
+    "concept_map": (
+        "Visually distinct nodes representing key concepts",
+        "Clear connectors showing relationships between concepts",
+        "Spatial organization that reflects conceptual relationships",
+    ),
+}
+
+# Creative approaches, formatted with the visual type and topic
+_CREATIVE_APPROACHES = (
+    "Create a {visual_type} that emphasizes the key relationships in {topic} through thoughtful visual hierarchy and organization.",
+    "Design a visually engaging {visual_type} that makes {topic} immediately understandable through clear visual storytelling.",
+    "Develop a {visual_type} that breaks down {topic} into clear, digestible components that build understanding step by step.",
+    "Create an elegant, minimalist {visual_type} that distills {topic} to its essential elements while maintaining clarity.",
+    "Design a visually rich {visual_type} that shows the interconnections within {topic} through thoughtful visual mapping.",
+)
+
+# Project root and generated image directory, resolved once instead of per request
+_BASE_DIR = os.getcwd()
+_GEN_DIR = os.path.join(_BASE_DIR, "generated_images")
+# Created up front so exposing an external image can't fail on a missing destination
+os.makedirs(_GEN_DIR, exist_ok=True)
+
+# Persistent map from image cache key to generated file, survives restarts
+_IMAGE_INDEX_PATH = os.path.join(_GEN_DIR, ".index.json")
+
+_URL_SCHEME_RE = re.compile(r'^https?://')
+_IMG_EXTS = frozenset({".png", ".jpg"})
+_PLACEHOLDER_URL = "/static/images/placeholder.png"
+
+@lru_cache(maxsize=4096)
+def _classify_file_path(file_path: str) -> Tuple[str, Optional[str]]:
+    """
+    Map a file path to its client URL without touching the filesystem (memoized per path).
+    
+    Returns the URL and, for files outside the served directories, the source path
+    that still has to be exposed under generated_images before the URL resolves.
+    """
+    if not file_path:
+        return _PLACEHOLDER_URL, None
+    
+    filename = os.path.basename(file_path)
+    
+    # Classify the path once; each branch returns
+    if _URL_SCHEME_RE.match(file_path):
+        # Already a web URL
+        return file_path, None
+    elif "generated_images" in file_path and (
+        "/generated_images/" in file_path or os.path.splitext(filename)[1] in _IMG_EXTS
+    ):
+        # Inside the generated_images directory, or just an image filename
+        return f"/generated_images/{filename}", None
+    elif "/static/" in file_path:
+        # Handle static directory
+        return f"/static/{file_path.partition('/static/')[2]}", None
+    elif file_path.startswith(_BASE_DIR):
+        # Absolute path in the project directory
+        rel_path = os.path.relpath(file_path, _BASE_DIR)
+        if rel_path.startswith(("generated_images/", "static/")):
+            return f"/{rel_path}", None
+        # If it's in some other directory, put it under generated_images URL path
+        return f"/generated_images/{filename}", None
+    elif file_path.startswith("file://") or os.path.isabs(file_path):
+        # File URL or other absolute path outside project, expose it from generated_images
+        return f"/generated_images/{filename}", file_path.replace("file://", "")
+    
+    # Default - if we can't determine the URL path
+    return _PLACEHOLDER_URL, None
+
+def _file_path_to_url_impl(file_path: str) -> str:
+    """Convert a file path to a URL that can be accessed by clients, exposing external files first"""
+    url, source_path = _classify_file_path(file_path)
+    if source_path is None:
+        return url
+    
+    # Not memoized: a failed link or copy must be retried on the next request
+    target_path = os.path.join(_GEN_DIR, os.path.basename(source_path))
+    # Already exposed (or the source is the target itself)
+    if os.path.lexists(target_path):
+        return url
+    
+    try:
+        # Serve the file in place rather than copying it on the request thread
+        os.link(source_path, target_path)
+        return url
+    except OSError as link_error:
+        # Only check the source once linking failed, to tell a missing image from a link failure
+        if not os.path.exists(source_path):
+            logger.error(f"Image file not found: {source_path}")
+            return _PLACEHOLDER_URL
+        # Filesystem rejects links (or cross-device), fall back to a copy
+        logger.warning(f"Could not link {source_path} into generated_images, copying instead: {link_error}")
+    
+    try:
+        shutil.copy2(source_path, target_path)
+        return url
+    except OSError as e:
+        logger.error(f"Error copying {source_path} to generated_images: {e}")
+        return _PLACEHOLDER_URL
 
 class VisualAidsService:
     """Service for generating blackboard-friendly visual aids for educational use"""
     
+    # Static part of the drawing-instructions prompt, filled in per request
+    _PROMPT_TEMPLATE = """Create step-by-step instructions for drawing a simple visual based on this description: 
+"{description}"
+
+Subject: {subject}
+Topic: {topic}
+Visual type: {visual_type}
+Grade level: {grade_level_text}
+Complexity: {complexity} - {complexity_level}
+Intended for: Drawing on a {color_scheme} in a classroom setting
+Include labels: {include_labels}
+Include teaching instructions: {include_instructions}{template_suggestion}
+
+Format your response in these sections:
+1. DRAWING TITLE: Short, descriptive title
+2. MATERIALS NEEDED: Basic chalk/markers and any other materials
+3. STEP-BY-STEP DRAWING INSTRUCTIONS: Numbered steps (6-10 steps), each simple enough for a teacher to follow
+4. KEY LABELS: 3-8 important elements to label in the drawing
+5. TEACHING TIPS: 2-4 suggestions for using this visual effectively in teaching
+
+Important Guidelines:
+- Focus on creating a visual aid that DIRECTLY represents the user's description
+- Create instructions for a SIMPLE, CLEAR drawing that can be quickly reproduced on a blackboard
+- Focus on clarity over detail - use basic shapes and lines
+- Ensure the final drawing will fit on a standard blackboard
+- Use only features that can be created with chalk/basic markers
+- Avoid complex shading or tiny details
+- Ensure the visual aid effectively communicates the key concept
+
+Example elements to include: {examples}
+
+Additional requirements: {additional_requirements}"""
+    
     def __init__(self):
         self.subject_templates = {
             Subject.SCIENCE: {
@@ -49,169 +304,265 @@ class VisualAidsService:
             "text_elements": ["labels", "captions", "titles", "legends"],
             "connectors": ["arrows", "lines", "brackets", "dotted connectors"]
         }
+        
+        # Per-subject template keys with their word sets, in declaration order so the first match wins
+        self._template_keys: Dict[Subject, Tuple[Tuple[str, frozenset, str], ...]] = {
+            subject: tuple(
+                (key.lower(), frozenset(_KEY_SEPARATORS.split(key.lower())), template)
+                for key, template in templates.items()
+            )
+            for subject, templates in self.subject_templates.items()
+        }
+        
+        # Parsed text responses keyed by request fingerprint (only well-formed responses are cached)
+        self._text_cache: LRUCache = LRUCache(maxsize=1024)
+        self._text_cache_lock = threading.Lock()
+        # Text generation calls in flight, keyed by request fingerprint, shared by identical requests
+        self._text_in_flight: Dict[Tuple, asyncio.Future] = {}
+        
+        # Generated images keyed by _image_cache_key, loaded from and written back to disk
+        self._image_index: Dict[str, str] = self._load_image_index()
+        self._image_index_lock = threading.Lock()
     
-    def generate_visual_aid(self, request: VisualAidRequest, user_id: Optional[str] = None) -> VisualAidResponse:
-        """Generate blackboard-friendly visual aid based on the request"""
-        start_time = datetime.now()
+    async def generate_visual_aid_async(self, request: VisualAidRequest, user_id: Optional[str] = None) -> VisualAidResponse:
+        """Generate blackboard-friendly visual aid based on the request, overlapping text and image generation"""
+        if not user_id:
+            return await self._generate_core_async(request)
+        
+        start = time.perf_counter()
+        user_session = None
         
         try:
-            # Handle session if user_id is provided
-            if user_id:
-                # Get or create session for the user
-                user_session = session_service.get_session(user_id)
-                
-                # Update session with language preference
-                user_session.language_preference = request.language.value
-                
-                # Add the user request to session history
-                session_service.add_message(
-                    user_id=user_id,
-                    content=f"Generate {request.visual_type.value} about {request.topic} for grade {request.grade_levels}",
-                    agent_type="user",
-                    metadata={
-                        "language": request.language.value,
-                        "topic": request.topic,
-                        "visual_type": request.visual_type.value,
-                        "subject": request.subject.value
-                    }
-                )
-            
-            # Generate visual aid
-            prompt = self._generate_visual_aid_prompt(request)
-            response_text = generate_educational_content(prompt, request.language.value)
+            user_session = await session_service.get_session_async(user_id)
+            user_session.language_preference = request.language.value
+            await session_service.add_message_async(user_id=user_id, **self._request_message(request))
             
-            # Extract drawing instructions and teaching tips
-            drawing_instructions = self._extract_drawing_instructions(response_text)
-            teaching_tips = self._extract_teaching_tips(response_text)
+            response = await self._generate_core_async(request)
             
-            # Generate image and get local file path
-            image_file_path = self._generate_image_url(request)
+        except Exception as e:
+            logger.error(f"Error generating visual aid: {e}")
+            response = self._error_response(request, e, start)
+        
+        try:
+            if user_session is None:
+                user_session = await session_service.get_session_async(user_id)
             
-            # Convert to URL for client access
-            image_url = self._file_path_to_url(image_file_path)
+            await session_service.add_message_async(user_id=user_id, **self._result_message(request, response))
             
-            # Create visual aid object
-            topic = request.topic if request.topic else self._extract_topic_from_description(request.description)
-            visual_aid = VisualAid(
-                title=f"{topic} - {request.visual_type.value}",
-                description=request.description,
-                image_url=image_url,
-                image_path=image_file_path,
-                drawing_instructions=drawing_instructions,
-                visual_type=request.visual_type,
-                complexity=request.complexity,
-                estimated_drawing_time=self._estimate_drawing_time(request),
-                labels=self._extract_labels(response_text),
-                teaching_tips=teaching_tips
-            )
+            response.session = self._session_info(user_session)
+        except Exception as session_error:
+            logger.error(f"Error updating session for visual aid: {session_error}")
             
-            # Calculate generation time
-            generation_time = str(datetime.now() - start_time)
-            
-            # Create response object
-            response = VisualAidResponse(
-                status="success",
-                agent_type=AgentType.VISUAL_AIDS,
-                language=request.language,
-                subject=request.subject.value,
-                grade_levels=request.grade_levels,
-                visual_aids=[visual_aid],
-                generation_time=generation_time,
-                metadata={
+        return response
+    
+    def _request_message(self, request: VisualAidRequest) -> Dict[str, Any]:
+        """Session history entry recording the user's request"""
+        return {
+            "content": f"Generate {request.visual_type.value} about {request.topic} for grade {request.grade_levels}",
+            "agent_type": "user",
+            "metadata": {
+                "language": request.language.value,
+                "topic": request.topic,
+                "visual_type": request.visual_type.value,
+                "subject": request.subject.value
+            }
+        }
+    
+    def _result_message(self, request: VisualAidRequest, response: VisualAidResponse) -> Dict[str, Any]:
+        """Session history entry recording the outcome of a request"""
+        if response.status == "success":
+            return {
+                "content": f"Generated visual aid for {request.topic}",
+                "agent_type": AgentType.VISUAL_AIDS.value,
+                "metadata": {
+                    "language": request.language.value,
                     "topic": request.topic,
                     "visual_type": request.visual_type.value,
-                    "complexity": request.complexity,
-                    "blackboard_friendly": request.blackboard_friendly
+                    "status": "success"
                 }
+            }
+        return {
+            "content": f"Error generating visual aid for {request.topic}: {response.error_message}",
+            "agent_type": AgentType.VISUAL_AIDS.value,
+            "metadata": {
+                "status": "error",
+                "error_message": response.error_message
+            }
+        }
+    
+    async def _generate_core_async(self, request: VisualAidRequest) -> VisualAidResponse:
+        """Generate the visual aid for a request independent of any user session; the image call has no async API so it runs in a worker thread"""
+        start = time.perf_counter()
+        
+        try:
+            text_content, image_file_path = await asyncio.gather(
+                self._generate_text_content_async(request),
+                asyncio.to_thread(self._generate_image_url, request),
             )
             
-            # Add agent response to session if user_id is provided
-            if user_id:
-                user_session = session_service.get_session(user_id)
-                session_service.add_message(
-                    user_id=user_id,
-                    content=f"Generated visual aid for {request.topic}",
-                    agent_type=AgentType.VISUAL_AIDS.value,
-                    metadata={
-                        "language": request.language.value,
-                        "topic": request.topic,
-                        "visual_type": request.visual_type.value,
-                        "status": "success"
-                    }
-                )
-                
-                # Add session information to the response
-                response.session = SessionInfo(
-                    session_id=user_session.session_id,
-                    user_id=user_session.user_id,
-                    language_preference=user_session.language_preference,
-                    message_count=len(user_session.messages),
-                    context_keys=list(user_session.context.keys()) if user_session.context else [],
-                    last_active=user_session.last_active.isoformat() if isinstance(user_session.last_active, datetime) else str(user_session.last_active)
-                )
-            
-            return response
+            return self._build_response(request, text_content, image_file_path, start)
             
         except Exception as e:
             logger.error(f"Error generating visual aid: {e}")
-            error_response = VisualAidResponse(
-                status="error",
-                agent_type=AgentType.VISUAL_AIDS,
-                language=request.language,
-                subject=request.subject.value,
-                grade_levels=request.grade_levels,
-                visual_aids=[],
-                error_message=str(e),
-                generation_time=str(datetime.now() - start_time)
-            )
-            
-            # Add error response to session if user_id is provided
-            if user_id:
-                try:
-                    user_session = session_service.get_session(user_id)
-                    session_service.add_message(
-                        user_id=user_id,
-                        content=f"Error generating visual aid for {request.topic}: {str(e)}",
-                        agent_type=AgentType.VISUAL_AIDS.value,
-                        metadata={
-                            "status": "error",
-                            "error_message": str(e)
-                        }
-                    )
-                    
-                    # Add session information to the error response
-                    error_response.session = SessionInfo(
-                        session_id=user_session.session_id,
-                        user_id=user_session.user_id,
-                        language_preference=user_session.language_preference,
-                        message_count=len(user_session.messages),
-                        context_keys=list(user_session.context.keys()) if user_session.context else [],
-                        last_active=user_session.last_active.isoformat() if isinstance(user_session.last_active, datetime) else str(user_session.last_active)
-                    )
-                except Exception as session_error:
-                    logger.error(f"Error updating session during error handling: {session_error}")
-                
-            return error_response
+            return self._error_response(request, e, start)
+    
+    def _build_response(self, request: VisualAidRequest, text_content: Tuple[str, List[str], List[str]],
+                        image_file_path: str, start: float) -> VisualAidResponse:
+        """Assemble the success response from the generated text and image"""
+        drawing_instructions, teaching_tips, labels = text_content
+        
+        # Convert to URL for client access
+        image_url = self._file_path_to_url(image_file_path)
+        
+        # Create visual aid object
+        topic = request.topic if request.topic else self._extract_topic_from_description(request.description)
+        visual_aid = VisualAid(
+            title=f"{topic} - {request.visual_type.value}",
+            description=request.description,
+            image_url=image_url,
+            image_path=image_file_path,
+            drawing_instructions=drawing_instructions,
+            visual_type=request.visual_type,
+            complexity=request.complexity,
+            estimated_drawing_time=self._estimate_drawing_time(request),
+            labels=labels,
+            teaching_tips=teaching_tips
+        )
+        
+        # Calculate generation time
+        generation_time = f"{(time.perf_counter() - start) * 1000.0:.1f}ms"
+        
+        # Create response object
+        return VisualAidResponse(
+            status="success",
+            agent_type=AgentType.VISUAL_AIDS,
+            language=request.language,
+            subject=request.subject.value,
+            grade_levels=request.grade_levels,
+            visual_aids=[visual_aid],
+            generation_time=generation_time,
+            metadata={
+                "topic": request.topic,
+                "visual_type": request.visual_type.value,
+                "complexity": request.complexity,
+                "blackboard_friendly": request.blackboard_friendly
+            }
+        )
+    
+    def _error_response(self, request: VisualAidRequest, error: Exception, start: float) -> VisualAidResponse:
+        """Build the error response for a failed visual aid request"""
+        return VisualAidResponse(
+            status="error",
+            agent_type=AgentType.VISUAL_AIDS,
+            language=request.language,
+            subject=request.subject.value,
+            grade_levels=request.grade_levels,
+            visual_aids=[],
+            error_message=str(error),
+            generation_time=f"{(time.perf_counter() - start) * 1000.0:.1f}ms"
+        )
+    
+    def _session_info(self, user_session) -> SessionInfo:
+        """Build the session summary attached to responses"""
+        return SessionInfo(
+            session_id=user_session.session_id,
+            user_id=user_session.user_id,
+            language_preference=user_session.language_preference,
+            message_count=user_session.message_count,
+            context_keys=list(user_session.context.keys()) if user_session.context else [],
+            last_active=user_session.last_active.isoformat() if isinstance(user_session.last_active, datetime) else str(user_session.last_active)
+        )
+    
+    def _request_fingerprint(self, request: VisualAidRequest) -> Tuple:
+        """Build a hashable key from every request field that affects the generated text"""
+        return (
+            request.description,
+            request.topic,
+            request.subject,
+            request.visual_type,
+            request.complexity,
+            request.language,
+            tuple(request.grade_levels or ()),
+            request.color_scheme,
+            request.include_labels,
+            request.include_instructions,
+            request.additional_requirements,
+        )
+    
+    def _rng(self, request: VisualAidRequest) -> random.Random:
+        """Random generator seeded by the request fingerprint, so identical requests make identical choices"""
+        # hash() of str and Enum is salted per process, so seed from a digest that is stable across workers
+        canonical = json.dumps(self._request_fingerprint(request), default=lambda value: getattr(value, "value", str(value)))
+        seed = int.from_bytes(hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).digest(), "big")
+        return random.Random(seed)
+    
+    async def _generate_text_content_async(self, request: VisualAidRequest) -> Tuple[str, List[str], List[str]]:
+        """Generate and parse the drawing instructions, teaching tips and labels, memoized per request"""
+        fingerprint = self._request_fingerprint(request)
+        cached = self._cached_text_content(request, fingerprint)
+        if cached is not None:
+            return cached
+        
+        # Identical requests that miss the cache together share one model call
+        task = self._text_in_flight.get(fingerprint)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_text_content(request, fingerprint))
+            self._text_in_flight[fingerprint] = task
+            task.add_done_callback(lambda done: self._forget_text_request(fingerprint, done))
+        else:
+            logger.info(f"Joining in-flight visual aid text generation for topic: {request.topic}")
+        
+        # Shield the shared call so one cancelled request doesn't cancel it for the others
+        return await asyncio.shield(task)
+    
+    async def _fetch_text_content(self, request: VisualAidRequest, fingerprint: Tuple) -> Tuple[str, List[str], List[str]]:
+        """Call the model for a request's text and parse (and cache) the response"""
+        prompt = self._generate_visual_aid_prompt(request)
+        response_text = await generate_educational_content_async(prompt, request.language.value)
+        return self._store_text_content(fingerprint, response_text)
+    
+    def _forget_text_request(self, fingerprint: Tuple, task: asyncio.Future) -> None:
+        if self._text_in_flight.get(fingerprint) is task:
+            del self._text_in_flight[fingerprint]
+    
+    def _cached_text_content(self, request: VisualAidRequest, fingerprint: Tuple) -> Optional[Tuple[str, List[str], List[str]]]:
+        """Look up previously parsed text for a request fingerprint"""
+        with self._text_cache_lock:
+            cached = self._text_cache.get(fingerprint)
+        if cached is not None:
+            logger.info(f"Using cached visual aid text for topic: {request.topic}")
+        return cached
+    
+    def _store_text_content(self, fingerprint: Tuple, response_text: str) -> Tuple[str, List[str], List[str]]:
+        """Parse a model response and cache it when it is well formed"""
+        sections = self._parse_sections(response_text)
+        result = (
+            self._extract_drawing_instructions(sections, response_text),
+            self._extract_teaching_tips(sections),
+            self._extract_labels(sections),
+        )
+        
+        # Error and fallback messages have no sections, don't pin them in the cache
+        if sections:
+            with self._text_cache_lock:
+                self._text_cache[fingerprint] = result
+        return result
     
     def _generate_visual_aid_prompt(self, request: VisualAidRequest) -> str:
         """Generate prompt for creating a visual aid based primarily on the description"""
-        complexity_guide = {
-            "simple": "Use minimal elements, focus on core concepts only, 3-5 components max",
-            "medium": "Include main concepts with some supporting details, 5-8 components",
-            "detailed": "Include comprehensive details while keeping it drawable, 8-12 components max"
-        }
-        
-        complexity_level = complexity_guide.get(request.complexity.lower(), complexity_guide["medium"])
+        complexity_level = _COMPLEXITY_GUIDE.get(request.complexity.lower(), _COMPLEXITY_GUIDE["medium"])
         
         # Extract topic from description if not provided
         topic = request.topic if request.topic else self._extract_topic_from_description(request.description)
         
         # Get subject-specific template if available
-        subject_templates = self.subject_templates.get(request.subject, {})
         template_suggestion = ""
         
-        for key, template in subject_templates.items():
-            if topic and (key.lower() in topic.lower() or topic.lower() in key.lower()):
+        # A key matches when all of its words appear in the topic, or the topic is part of the key
+        topic_lower = (topic or "").lower()
+        topic_words = set(_KEY_SEPARATORS.split(topic_lower))
+        for key, key_words, template in self._template_keys.get(request.subject, ()):
+            if topic_lower and (key_words <= topic_words or topic_lower in key):
                 template_suggestion = f"\nReference template: {template}"
                 break
         
@@ -219,84 +570,78 @@ class VisualAidsService:
         visual_type = request.visual_type.value
         grade_level_text = ', '.join(map(str, request.grade_levels)) if request.grade_levels else "middle school"
         
-        return f"""Create step-by-step instructions for drawing a simple visual based on this description: 
-"{request.description}"
-
-Subject: {request.subject.value}
-Topic: {topic}
-Visual type: {visual_type}
-Grade level: {grade_level_text}
-Complexity: {request.complexity} - {complexity_level}
-Intended for: Drawing on a {request.color_scheme} in a classroom setting
-Include labels: {"Yes" if request.include_labels else "No"}
-Include teaching instructions: {"Yes" if request.include_instructions else "No"}{template_suggestion}
-
-Format your response in these sections:
-1. DRAWING TITLE: Short, descriptive title
-2. MATERIALS NEEDED: Basic chalk/markers and any other materials
-3. STEP-BY-STEP DRAWING INSTRUCTIONS: Numbered steps (6-10 steps), each simple enough for a teacher to follow
-4. KEY LABELS: 3-8 important elements to label in the drawing
-5. TEACHING TIPS: 2-4 suggestions for using this visual effectively in teaching
-
-Important Guidelines:
-- Focus on creating a visual aid that DIRECTLY represents the user's description
-- Create instructions for a SIMPLE, CLEAR drawing that can be quickly reproduced on a blackboard
-- Focus on clarity over detail - use basic shapes and lines
-- Ensure the final drawing will fit on a standard blackboard
-- Use only features that can be created with chalk/basic markers
-- Avoid complex shading or tiny details
-- Ensure the visual aid effectively communicates the key concept
-
-Example elements to include: {", ".join(random.sample(self.drawing_elements["basic_shapes"], 2) + random.sample(self.drawing_elements["lines"], 1) + random.sample(self.drawing_elements["text_elements"], 1))}
-
-Additional requirements: {request.additional_requirements or "Keep it simple and clear"}"""
+        # Seed the example elements from the request so identical requests build identical prompts
+        rng = self._rng(request)
+        example_elements = ", ".join(
+            rng.sample(self.drawing_elements["basic_shapes"], 2)
+            + rng.sample(self.drawing_elements["lines"], 1)
+            + rng.sample(self.drawing_elements["text_elements"], 1)
+        )
+        
+        return self._PROMPT_TEMPLATE.format(
+            description=request.description,
+            subject=request.subject.value,
+            topic=topic,
+            visual_type=visual_type,
+            grade_level_text=grade_level_text,
+            complexity=request.complexity,
+            complexity_level=complexity_level,
+            color_scheme=request.color_scheme,
+            include_labels="Yes" if request.include_labels else "No",
+            include_instructions="Yes" if request.include_instructions else "No",
+            template_suggestion=template_suggestion,
+            examples=example_elements,
+            additional_requirements=request.additional_requirements or "Keep it simple and clear"
+        )
     
-    def _extract_drawing_instructions(self, response_text: str) -> str:
-        """Extract step-by-step drawing instructions from response text"""
-        instructions_pattern = r"STEP-BY-STEP DRAWING INSTRUCTIONS:(.*?)(?:KEY LABELS:|TEACHING TIPS:|$)"
-        instructions_match = re.search(instructions_pattern, response_text, re.DOTALL | re.IGNORECASE)
+    def _parse_sections(self, response_text: str) -> Dict[str, str]:
+        """Split the response text into its labeled sections in one scan"""
+        sections = {}
+        matches = list(_SECTIONS_RE.finditer(response_text))
+        
+        for match, next_match in zip(matches, matches[1:] + [None]):
+            end = next_match.start() if next_match else len(response_text)
+            # Keep the first occurrence of each heading
+            sections.setdefault(match.group("head").upper(), response_text[match.end():end].strip())
         
-        if instructions_match:
-            return instructions_match.group(1).strip()
+        return sections
+    
+    def _extract_drawing_instructions(self, sections: Dict[str, str], response_text: str) -> str:
+        """Extract step-by-step drawing instructions from the parsed sections"""
+        instructions = sections.get("STEP-BY-STEP DRAWING INSTRUCTIONS")
+        
+        if instructions is not None:
+            return instructions
         
         # If specific section isn't found, return the whole text
         return response_text
     
-    def _extract_teaching_tips(self, response_text: str) -> List[str]:
-        """Extract teaching tips from response text"""
-        tips_pattern = r"TEACHING TIPS:(.*?)(?:$)"
-        tips_match = re.search(tips_pattern, response_text, re.DOTALL | re.IGNORECASE)
+    def _split_list_items(self, text: str) -> List[str]:
+        """Split a numbered or bulleted list into items, one per line"""
+        items = (_BULLET_PREFIX.sub('', line).strip() for line in text.splitlines())
+        return [item for item in items if item]
+    
+    def _extract_teaching_tips(self, sections: Dict[str, str]) -> List[str]:
+        """Extract teaching tips from the parsed sections"""
+        tips_text = sections.get("TEACHING TIPS")
         
-        if tips_match:
-            tips_text = tips_match.group(1).strip()
-            # Split by numbered items or bullet points
-            tips = re.split(r'\d+\.|\-', tips_text)
-            return [tip.strip() for tip in tips if tip.strip()]
+        if tips_text:
+            return self._split_list_items(tips_text)
         
         return []
     
-    def _extract_labels(self, response_text: str) -> List[str]:
-        """Extract key labels from response text"""
-        labels_pattern = r"KEY LABELS:(.*?)(?:TEACHING TIPS:|$)"
-        labels_match = re.search(labels_pattern, response_text, re.DOTALL | re.IGNORECASE)
+    def _extract_labels(self, sections: Dict[str, str]) -> List[str]:
+        """Extract key labels from the parsed sections"""
+        labels_text = sections.get("KEY LABELS")
         
-        if labels_match:
-            labels_text = labels_match.group(1).strip()
-            # Split by numbered items or bullet points
-            labels = re.split(r'\d+\.|\-', labels_text)
-            return [label.strip() for label in labels if label.strip()]
+        if labels_text:
+            return self._split_list_items(labels_text)
         
         return []
     
     def _estimate_drawing_time(self, request: VisualAidRequest) -> str:
         """Estimate time to complete the drawing"""
-        complexity_times = {
-            "simple": "2-3",
-            "medium": "4-6",
-            "detailed": "7-10"
-        }
-        
-        return f"{complexity_times.get(request.complexity.lower(), '5')} minutes"
+        return f"{_COMPLEXITY_TIMES.get(request.complexity.lower(), '5')} minutes"
     
     def _extract_topic_from_description(self, description: str) -> str:
         """Extract a topic from the description using intelligent parsing"""
@@ -305,58 +650,35 @@ Additional requirements: {request.additional_requirements or "Keep it simple and
             return "educational visual aid"
             
         # Try to extract a reasonable topic from the first sentence
-        first_sentence = description.split('.')[0]
-        # If first sentence is too long, take first 5-10 words
-        words = first_sentence.split()
+        first_sentence = description.partition('.')[0]
+        # If first sentence is too long, take first 5-10 words; at most words 0-14 are ever
+        # used, so stop splitting after those (the remainder lands in words[15])
+        words = first_sentence.split(None, 15)
         
         if len(words) <= 5:
             return first_sentence
         else:
             # Look for common topic patterns like "about", "on", "for", "of", etc.
             for idx, word in enumerate(words[:10]):
-                if word.lower() in ["about", "on", "for", "of", "regarding"] and idx < len(words) - 1:
+                if word.lower() in _TOPIC_MARKERS and idx < len(words) - 1:
                     return " ".join(words[idx+1:min(idx+6, len(words))])
             
             # If no pattern found, take first 5 words
             return " ".join(words[:5])
             
-    def _analyze_visual_context(self, request: VisualAidRequest, topic: str) -> str:
+    def _analyze_visual_context(self, request: VisualAidRequest, topic: str, rng: random.Random) -> str:
         """Analyze the context of the visual aid to generate a deeper understanding"""
-        import random
-        
-        # Define contextual frameworks based on subject areas
-        science_contexts = [
-            f"a conceptual model showing the key processes involved in {topic}",
-            f"a visual representation of the structure and components of {topic}",
-            f"an illustrated explanation of how {topic} works and its significance",
-            f"a comparative visualization showing different aspects of {topic}"
-        ]
-        
-        math_contexts = [
-            f"a visual representation of {topic} showing mathematical relationships",
-            f"an illustrated explanation of the {topic} concept with examples",
-            f"a step-by-step visual guide to understanding {topic}",
-            f"a conceptual model demonstrating how {topic} applies in different situations"
-        ]
-        
-        social_contexts = [
-            f"a visual overview of key concepts in {topic}",
-            f"an illustrated timeline or process diagram explaining {topic}",
-            f"a conceptual map showing relationships between aspects of {topic}",
-            f"a visual representation comparing different perspectives on {topic}"
-        ]
-        
         # Select context framework based on subject
         if request.subject.value.lower() in ["science", "biology", "chemistry", "physics"]:
-            contexts = science_contexts
+            contexts = _SCIENCE_CONTEXTS
         elif request.subject.value.lower() in ["mathematics", "math", "algebra", "geometry"]:
-            contexts = math_contexts
+            contexts = _MATH_CONTEXTS
         else:
-            contexts = social_contexts
+            contexts = _SOCIAL_CONTEXTS
             
-        # Select a random context appropriate for the subject area
+        # Select a context appropriate for the subject area
         # This ensures variety in the generated images
-        selected_context = random.choice(contexts)
+        selected_context = rng.choice(contexts).format(topic=topic)
         
         # Enhance with visual type specific details
         if request.visual_type.value == "flowchart":
@@ -368,120 +690,46 @@ Additional requirements: {request.additional_requirements or "Keep it simple and
             
         return selected_context
         
-    def _determine_pedagogical_approach(self, subject, grade_range: str) -> str:
+    def _determine_pedagogical_approach(self, subject, grade_range: str, rng: random.Random) -> str:
         """Determine appropriate pedagogical approach based on subject and grade level"""
-        import random
-        
         # Extract approximate age/grade level
-        is_elementary = any(str(i) in grade_range for i in range(1, 6))
-        is_middle = any(str(i) in grade_range for i in range(6, 9)) or "middle" in grade_range.lower()
-        is_high = any(str(i) in grade_range for i in range(9, 13)) or "high" in grade_range.lower()
-        
-        # Define pedagogical approaches by level and subject
-        approaches = []
+        grades = {int(grade) for grade in _GRADE_RE.findall(grade_range)}
+        grade_range_lower = grade_range.lower()
+        is_elementary = bool(grades & _ELEMENTARY_GRADES)
+        is_middle = bool(grades & _MIDDLE_GRADES) or "middle" in grade_range_lower
+        is_high = bool(grades & _HIGH_GRADES) or "high" in grade_range_lower
         
+        # Pick pedagogical approaches by level
         if is_elementary:
-            approaches.extend([
-                "Concrete visual representations with simple, clear labels",
-                "Engaging, colorful illustrations that capture attention and interest",
-                "Simple visual storytelling to make concepts accessible",
-                "Direct visual representation of concrete concepts"
-            ])
+            approaches = _APPROACHES_ELEMENTARY
         elif is_middle:
-            approaches.extend([
-                "Balanced concrete and abstract representations",
-                "Visual analogies connecting new concepts to familiar ideas",
-                "Clear organizational structures showing relationships between concepts",
-                "Scaffolded visual explanations building conceptual understanding"
-            ])
+            approaches = _APPROACHES_MIDDLE
         elif is_high:
-            approaches.extend([
-                "Abstract representations emphasizing conceptual relationships",
-                "Sophisticated visual models showing multiple layers of understanding",
-                "Visual synthesis of complex ideas and their applications",
-                "Critical analysis frameworks presented visually"
-            ])
+            approaches = _APPROACHES_HIGH
         else:
             # Default to a general approach
-            approaches.extend([
-                "Clear visual representation appropriate for diverse learners",
-                "Balanced concrete and abstract visual elements",
-                "Structured visual framework highlighting key concepts"
-            ])
+            approaches = _APPROACHES_GENERAL
         
-        # Select a random approach from appropriate options
+        # Select an approach from appropriate options
         # This ensures variety in the educational approach
-        return random.choice(approaches)
+        return rng.choice(approaches)
         
-    def _create_dynamic_style_guide(self, visual_type, subject) -> str:
+    def _create_dynamic_style_guide(self, visual_type, subject, rng: random.Random) -> str:
         """Create a dynamic style guide based on visual type and subject"""
-        import random
-        
-        # Base style elements that apply to all educational visuals
-        base_style = [
-            "Clean, professional educational design with clear purpose",
-            "Thoughtful layout with proper spacing and visual hierarchy",
-            "Appropriate use of color to highlight important concepts",
-            "Clear labels integrated with visual elements",
-            "White background for maximum clarity and focus"
-        ]
-        
         # Add style elements specific to the visual type
-        type_specific = []
-        
-        if visual_type.value == "line_drawing":
-            type_specific.extend([
-                "Precise, confident line work with varying line weights",
-                "Minimal shading only where necessary for clarity",
-                "Clean contours defining all important elements"
-            ])
-        elif visual_type.value == "chart":
-            type_specific.extend([
-                "Clear axes with appropriate scales and labels",
-                "Distinct data representations with strong visual contrast",
-                "Legend explaining all visual elements used"
-            ])
-        elif visual_type.value == "diagram":
-            type_specific.extend([
-                "Precise illustration of components with clear boundaries",
-                "Strategic use of cutaways or cross-sections where helpful",
-                "Visual emphasis on key structural relationships"
-            ])
-        elif visual_type.value == "flowchart":
-            type_specific.extend([
-                "Clear directional indicators showing process flow",
-                "Distinct shapes for different types of steps or decisions",
-                "Logical layout that guides the eye through the process"
-            ])
-        elif visual_type.value == "concept_map":
-            type_specific.extend([
-                "Visually distinct nodes representing key concepts",
-                "Clear connectors showing relationships between concepts",
-                "Spatial organization that reflects conceptual relationships"
-            ])
+        type_specific = _TYPE_SPECIFIC_STYLES.get(visual_type.value, ())
         
         # Combine base style with type-specific elements
-        # Randomly select a subset to create variation
-        combined_elements = base_style + random.sample(type_specific, min(2, len(type_specific)))
+        # Select a subset to create variation
+        combined_elements = _BASE_STYLE + tuple(rng.sample(type_specific, min(2, len(type_specific))))
         
         # Format as bullet points
         return "\n".join(f"- {element}" for element in combined_elements)
         
-    def _generate_creative_direction(self, request: VisualAidRequest, topic: str) -> str:
+    def _generate_creative_direction(self, request: VisualAidRequest, topic: str, rng: random.Random) -> str:
         """Generate a unique creative direction for this specific visual aid"""
-        import random
-        
-        # Create a unique creative approach each time
-        creative_approaches = [
-            f"Create a {request.visual_type.value} that emphasizes the key relationships in {topic} through thoughtful visual hierarchy and organization.",
-            f"Design a visually engaging {request.visual_type.value} that makes {topic} immediately understandable through clear visual storytelling.",
-            f"Develop a {request.visual_type.value} that breaks down {topic} into clear, digestible components that build understanding step by step.",
-            f"Create an elegant, minimalist {request.visual_type.value} that distills {topic} to its essential elements while maintaining clarity.",
-            f"Design a visually rich {request.visual_type.value} that shows the interconnections within {topic} through thoughtful visual mapping."
-        ]
-        
-        # Select a random creative approach
-        main_direction = random.choice(creative_approaches)
+        # Select a creative approach
+        main_direction = rng.choice(_CREATIVE_APPROACHES).format(visual_type=request.visual_type.value, topic=topic)
         
         # Add specific guidance based on complexity
         if request.complexity.lower() == "simple":
@@ -495,67 +743,7 @@ Additional requirements: {request.additional_requirements or "Keep it simple and
             
     def _file_path_to_url(self, file_path: str) -> str:
         """Convert a file path to a URL that can be accessed by clients"""
-        import os
-        
-        if not file_path:
-            return "/static/images/placeholder.png"
-            
-        # Handle different types of paths
-        if file_path.startswith("http://") or file_path.startswith("https://"):
-            # Already a web URL
-            return file_path
-        
-        # Get current working directory - the project root
-        base_dir = os.getcwd()
-        
-        # Handle generated_images directory
-        if "generated_images" in file_path:
-            # Extract the part after "generated_images"
-            if "/generated_images/" in file_path:
-                # Extract the filename
-                filename = os.path.basename(file_path)
-                return f"/generated_images/{filename}"
-            elif file_path.endswith(".png") or file_path.endswith(".jpg"):
-                # Just the filename
-                filename = os.path.basename(file_path)
-                return f"/generated_images/{filename}"
-        
-        # Handle static directory
-        if "/static/" in file_path:
-            parts = file_path.split("/static/")
-            if len(parts) > 1:
-                return f"/static/{parts[1]}"
-        
-        # If it's an absolute path in the project directory
-        if file_path.startswith(base_dir):
-            rel_path = os.path.relpath(file_path, base_dir)
-            # Format according to the directory structure
-            if rel_path.startswith("generated_images/"):
-                return f"/{rel_path}"
-            elif rel_path.startswith("static/"):
-                return f"/{rel_path}"
-            else:
-                # If it's in some other directory, put it under generated_images URL path
-                filename = os.path.basename(file_path)
-                return f"/generated_images/{filename}"
-                
-        # If it's a file:// URL or other absolute path outside project
-        if file_path.startswith("file://") or os.path.isabs(file_path):
-            filename = os.path.basename(file_path)
-            # We'll need to copy this file to our generated_images directory
-            try:
-                import shutil
-                target_path = os.path.join(base_dir, "generated_images", filename)
-                # Only copy if source exists and isn't the same as target
-                if os.path.exists(file_path.replace("file://", "")) and file_path.replace("file://", "") != target_path:
-                    shutil.copy2(file_path.replace("file://", ""), target_path)
-                return f"/generated_images/{filename}"
-            except Exception as e:
-                logger.error(f"Error copying file to generated_images: {e}")
-                return "/static/images/placeholder.png"
-        
-        # Default - if we can't determine the URL path
-        return "/static/images/placeholder.png"
+        return _file_path_to_url_impl(file_path)
     
     def _generate_image_url(self, request: VisualAidRequest) -> str:
         """
@@ -564,30 +752,37 @@ Additional requirements: {request.additional_requirements or "Keep it simple and
         the specific request parameters.
         
         This implementation:
-        1. Creates a dynamic, customized prompt based on the educational context
-        2. Generates a unique image using Vertex AI advanced models
-        3. Returns a local file path to the freshly generated image
+        1. Returns the previously generated image when the persistent index has one
+        2. Creates a dynamic, customized prompt based on the educational context
+        3. Generates a unique image using Vertex AI advanced models
+        4. Records and returns a local file path to the freshly generated image
         """
-        from app.core.vertex_ai import generate_image
-        import os
-        import random
+        # Reuse a previously generated image for the same visual
+        cache_key = self._image_cache_key(request)
+        cached_path = self._cached_image(cache_key)
+        if cached_path:
+            logger.info(f"Using cached image for topic: {request.topic}")
+            return cached_path
         
         # Extract core concepts from the request
         topic = request.topic if request.topic else self._extract_topic_from_description(request.description)
         visual_type = request.visual_type.value if request.visual_type else "diagram"
         
+        # One generator seeded by the request drives every creative choice below
+        rng = self._rng(request)
+        
         # Create a contextual understanding of what kind of visual this is
-        contextual_understanding = self._analyze_visual_context(request, topic)
+        contextual_understanding = self._analyze_visual_context(request, topic, rng)
         
         # Define pedagogical goals based on grade level and subject
         grade_range = ', '.join(map(str, request.grade_levels)) if request.grade_levels else 'middle school'
-        pedagogical_approach = self._determine_pedagogical_approach(request.subject, grade_range)
+        pedagogical_approach = self._determine_pedagogical_approach(request.subject, grade_range, rng)
         
         # Create a dynamic style guide based on the visual type and subject
-        style_attributes = self._create_dynamic_style_guide(request.visual_type, request.subject)
+        style_attributes = self._create_dynamic_style_guide(request.visual_type, request.subject, rng)
         
         # Generate a unique creative direction for this specific visual
-        creative_direction = self._generate_creative_direction(request, topic)
+        creative_direction = self._generate_creative_direction(request, topic, rng)
         
         # Craft a detailed AI-optimized prompt for image generation
         image_prompt = f"""Create a unique, educational {visual_type} about "{topic}" for {request.subject.value} teaching.
@@ -621,9 +816,55 @@ IMPORTANT: Create a unique, custom visual that effectively communicates this spe
             return placeholder_path
             
         logger.info(f"Generated image saved at: {local_file_path}")
+        self._store_cached_image(cache_key, local_file_path)
         
         # Return the actual file path - we'll convert to URL separately
         return local_file_path
+    
+    def _image_cache_key(self, request: VisualAidRequest) -> str:
+        """Stable key over the request fields that determine the generated image"""
+        normalized = (
+            (request.topic or "").strip().lower(),
+            request.description.strip().lower(),
+            request.visual_type.value if request.visual_type else "",
+            request.subject.value if request.subject else "",
+            (request.complexity or "").lower(),
+            (request.color_scheme or "").lower(),
+        )
+        return hashlib.blake2b(json.dumps(normalized).encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _load_image_index(self) -> Dict[str, str]:
+        """Read the on-disk image index, starting empty if it is missing or unreadable"""
+        try:
+            with open(_IMAGE_INDEX_PATH, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            return index if isinstance(index, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable image index {_IMAGE_INDEX_PATH}: {e}")
+            return {}
+    
+    def _cached_image(self, cache_key: str) -> Optional[str]:
+        """Previously generated image for a cache key, if the file is still on disk"""
+        with self._image_index_lock:
+            file_path = self._image_index.get(cache_key)
+        if file_path and os.path.exists(file_path):
+            return file_path
+        return None
+    
+    def _store_cached_image(self, cache_key: str, file_path: str) -> None:
+        """Record a generated image and persist the index atomically"""
+        try:
+            with self._image_index_lock:
+                self._image_index[cache_key] = file_path
+                os.makedirs(_GEN_DIR, exist_ok=True)
+                tmp_path = f"{_IMAGE_INDEX_PATH}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._image_index, f)
+                os.replace(tmp_path, _IMAGE_INDEX_PATH)
+        except OSError as e:
+            logger.warning(f"Could not persist image index: {e}")
 
 # Create a singleton instance
 visual_aids_service = VisualAidsService()
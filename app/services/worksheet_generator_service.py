@@ -1,13 +1,23 @@
+import asyncio
 import os
-import uuid
 import time
 import base64
 import hashlib
-from typing import Optional, Dict, Any, List, Tuple
+import io
+import re
+import shutil
+import sqlite3
+import threading
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, Hashable
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 import tempfile
 import json
+from xml.sax.saxutils import escape
+
+import numpy as np
+from cachetools import LRUCache, TTLCache
 
 # PDF generation
 from reportlab.lib.pagesizes import letter
@@ -21,22 +31,322 @@ from google import genai
 from google.genai import types
 
 # Project imports
-from app.models.worksheet_model import WorksheetType, WorksheetRequest, WorksheetResponse
+from app.core.config import WORKSHEET_RAG_TOP_K, WORKSHEET_RAG_METADATA_FILTER
+from app.models.worksheet_model import WorksheetType, WorksheetRequest, WorksheetResponse, WorksheetContent
 from app.services.session_service import session_service
 from app.utils.logger import logger
 
 
+# RAG response cache settings
+RAG_CACHE_TTL_SECONDS = 24 * 60 * 60
+RAG_SEMANTIC_THRESHOLD = 0.95
+_SEMANTIC_INITIAL_ROWS = 16
+EMBEDDING_MODEL = "text-embedding-005"
+# Embeddings are served regionally, not from the global endpoint used for generation
+EMBEDDING_LOCATION = "us-central1"
+# The embedding runs before generation on every exact-cache miss, so bound how long it can hold it up
+EMBEDDING_TIMEOUT_SECONDS = 1.5
+# After an embedding failure, skip the semantic tier for this long instead of paying a failing call per miss
+EMBEDDING_FAILURE_BACKOFF_SECONDS = 5 * 60
+
+# Built-PDF cache limits; keys include the date, so entries from earlier days are never hit again
+PDF_CACHE_MAX_AGE_SECONDS = 2 * 24 * 60 * 60
+PDF_CACHE_MAX_FILES = 1000
+PDF_CACHE_PRUNE_INTERVAL_SECONDS = 60 * 60
+
+# Output budget: per question (with its answer key entry) plus title/instructions, capped.
+# Indic scripts take several tokens per word, so other languages get a larger per-question budget.
+TOKENS_PER_QUESTION = 120
+TOKENS_PER_QUESTION_NON_LATIN = 360
+BASE_OUTPUT_TOKENS = 512
+MAX_OUTPUT_TOKENS = 8192
+_LATIN_SCRIPT_LANGUAGES = frozenset({"english"})
+
+# Student-facing instructions printed on each worksheet type
+_INSTRUCTIONS = {
+    WorksheetType.MULTIPLE_CHOICE: "Instructions: Circle the letter of the correct answer for each question.",
+    WorksheetType.FILL_IN_BLANKS: "Instructions: Fill in the blanks with the correct word or phrase.",
+    WorksheetType.SHORT_ANSWERS: "Instructions: Answer each question with complete sentences.",
+}
+
+# JSON reply wrapped in a markdown code fence
+_JSON_FENCE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.DOTALL)
+
+# Response shape requested in the prompt; JSON mode can't be combined with the retrieval tool.
+# Braces are doubled because the prompt template is passed through str.format.
+_JSON_RESPONSE_FORMAT = """Return only a JSON object, with no other text, in this form:
+{{"title": "<worksheet title>", "questions": [{{"question": "<question text>", "options": ["<option>", ...], "answer": "<correct answer>"}}]}}
+Leave "options" empty unless the question is multiple choice, and do not prefix options with letters."""
+
+# Whitespace and path separators, replaced when building PDF filenames
+_SLUG_SEPARATORS = re.compile(r'[\s/\\]+')
+
+
+def _unfence(content: str) -> str:
+    """Strip a markdown code fence around a JSON reply, if there is one."""
+    fenced = _JSON_FENCE.match(content)
+    return fenced.group(1) if fenced else content
+
+
+@lru_cache(maxsize=512)
+def _slugify(text: str) -> str:
+    """Filename-safe lowercase slug for a subject or topic."""
+    return _SLUG_SEPARATORS.sub('_', text).lower()
+
+
+class _RagResponseCache:
+    """
+    Two-tier cache for RAG responses.
+    
+    The first tier is keyed by the SHA-256 of the canonical request and is kept in
+    memory and on disk. The second tier compares query embeddings by cosine
+    similarity, only among requests with the same worksheet shape (grade, type,
+    question count, language), so a hit never changes the structure of a worksheet.
+    """
+    
+    def __init__(self, cache_dir: str, ttl_seconds: int, threshold: float):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._exact: TTLCache = TTLCache(maxsize=1024, ttl=ttl_seconds)
+        # Per worksheet shape: a C-contiguous float32 buffer of L2-normalised embedding rows
+        # (capacity >= count) and the matching (content, stored_at) for each filled row
+        self._semantic: Dict[Tuple, Tuple[np.ndarray, List[Tuple[str, float]]]] = {}
+        self._lock = threading.Lock()
+    
+    def get_exact(self, key: str) -> Optional[str]:
+        """Look up a response by exact request key, in memory first and then on disk."""
+        with self._lock:
+            content = self._exact.get(key)
+        if content is not None:
+            return content
+        
+        path = os.path.join(self.cache_dir, f"{key}.txt")
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except OSError:
+            return None
+        
+        with self._lock:
+            self._exact[key] = content
+        return content
+    
+    def get_similar(self, shape: Tuple, embedding: np.ndarray) -> Optional[str]:
+        """Return the freshest-enough response whose query embedding is within the threshold."""
+        with self._lock:
+            entry = self._semantic.get(shape)
+            if entry is None:
+                return None
+            matrix, items = entry
+            # Rows below the current count are complete; later appends don't touch them
+            count = len(items)
+        
+        # One float32 matrix-vector product (BLAS sgemv) over the live rows
+        scores = matrix[:count] @ np.ascontiguousarray(embedding, dtype=np.float32)
+        best = int(np.argmax(scores))
+        content, stored_at = items[best]
+        if scores[best] >= self.threshold and time.time() - stored_at <= self.ttl_seconds:
+            return content
+        return None
+    
+    def put(self, key: str, shape: Tuple, embedding: Optional[np.ndarray], content: str) -> None:
+        """Store a response in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._exact[key] = content
+            if embedding is not None:
+                self._append_embedding(shape, embedding, content, now)
+        
+        try:
+            with open(os.path.join(self.cache_dir, f"{key}.txt"), "w", encoding="utf-8") as f:
+                f.write(content)
+        except OSError as e:
+            logger.warning(f"Could not persist RAG cache entry {key}: {e}")
+
+    
+    def prune_disk(self) -> int:
+        """Delete persisted entries older than the TTL; returns how many were removed."""
+        now = time.time()
+        removed = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.name.endswith(".txt") and now - entry.stat().st_mtime > self.ttl_seconds:
+                            os.remove(entry.path)
+                            removed += 1
+                    except OSError:
+                        pass
+        except OSError as e:
+            logger.warning(f"Could not scan RAG cache directory: {e}")
+        return removed
+    
+    def _append_embedding(self, shape: Tuple, embedding: np.ndarray, content: str, now: float) -> None:
+        """Append a row to the shape's preallocated matrix, compacting and growing it only when full."""
+        matrix, items = self._semantic.get(shape, (None, []))
+        if matrix is None or matrix.shape[1] != embedding.shape[0]:
+            matrix, items = np.empty((_SEMANTIC_INITIAL_ROWS, embedding.shape[0]), dtype=np.float32), []
+        elif len(items) == matrix.shape[0]:
+            # Full: drop expired rows, then double the capacity left for live ones
+            keep = [i for i, (_, stored_at) in enumerate(items) if now - stored_at <= self.ttl_seconds]
+            grown = np.empty((max(_SEMANTIC_INITIAL_ROWS, 2 * len(keep)), matrix.shape[1]), dtype=np.float32)
+            grown[:len(keep)] = matrix[keep]
+            matrix, items = grown, [items[i] for i in keep]
+        
+        # Write the row before publishing the item so readers never see a partial row
+        matrix[len(items)] = embedding
+        items.append((content, now))
+        self._semantic[shape] = (matrix, items)
+
+
+class _EmbeddingCache:
+    """
+    Query embeddings keyed by the SHA-256 of the normalised text: a bounded
+    in-process LRU for the hot set, written through to a SQLite file so
+    embeddings survive restarts.
+    """
+    
+    def __init__(self, db_path: str, maxsize: int = 4096):
+        self._memory: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Lowercase and collapse whitespace so trivially different queries share an entry."""
+        return " ".join(text.lower().split())
+    
+    @staticmethod
+    def key(normalized_text: str) -> str:
+        """Cache key for a normalised query, scoped to the embedding model."""
+        return hashlib.sha256(f"{EMBEDDING_MODEL}\0{normalized_text}".encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Look up an embedding in memory, then on disk."""
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                return vector
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            vector = np.frombuffer(row[0], dtype=np.float32)
+            self._memory[key] = vector
+            return vector
+    
+    def put(self, key: str, vector: np.ndarray) -> None:
+        """Store an embedding in memory and write it through to disk."""
+        with self._lock:
+            self._memory[key] = vector
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                    (key, EMBEDDING_MODEL, vector.astype(np.float32).tobytes())
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not persist embedding {key}: {e}")
+
+
+class _TruncatedRagResponse(Exception):
+    """Raised when a RAG reply stopped at the output token limit."""
+
+
+class _RagRequestCoalescer:
+    """
+    Shares one RAG generation call between identical requests in flight at once.
+    
+    The first request for a key starts the call immediately; requests with the
+    same key that arrive before it finishes await the same task instead of
+    issuing their own. Nothing waits for a batch window.
+    """
+    
+    def __init__(self, generate: Callable[[str, Any], Awaitable[Any]]):
+        self._generate = generate
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+    
+    async def submit(self, key: Hashable, prompt: str, config: Any) -> Any:
+        """Start or join the generation call for a key and wait for its response."""
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate(prompt, config))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            logger.info("Joining in-flight RAG call for an identical request")
+        
+        # Shield the shared call so one cancelled request doesn't cancel it for the others
+        return await asyncio.shield(task)
+    
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+
 class WorksheetGeneratorService:
     """Service for generating educational worksheets based on subject, grade, and topic."""
     
+    # Request-invariant safety settings shared by every generation config
+    _SAFETY_SETTINGS = [
+        types.SafetySetting(
+            category="HARM_CATEGORY_HATE_SPEECH",
+            threshold="OFF"
+        ),
+        types.SafetySetting(
+            category="HARM_CATEGORY_DANGEROUS_CONTENT",
+            threshold="OFF"
+        ),
+        types.SafetySetting(
+            category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
+            threshold="OFF"
+        ),
+        types.SafetySetting(
+            category="HARM_CATEGORY_HARASSMENT",
+            threshold="OFF"
+        )
+    ]
+    
     def __init__(self):
         # Create directories for storing generated PDFs
         self.pdf_dir = os.path.join(os.getcwd(), "generated_pdfs")
         os.makedirs(self.pdf_dir, exist_ok=True)
         
+        # Content-addressed copies of built PDFs, served from the same static mount
+        self.pdf_cache_dir = os.path.join(self.pdf_dir, "cache")
+        os.makedirs(self.pdf_cache_dir, exist_ok=True)
+        self._pdf_cache_pruned_at = 0.0
+        self._embedding_disabled_until = 0.0
+        
         # Initialize Google AI client for RAG
         self._init_genai_client()
         
+        # Shares RAG calls between identical requests that are in flight together
+        self._rag_coalescer = _RagRequestCoalescer(self._call_rag_model)
+        
+        # Session history updates are drained by a background worker, started on first use
+        self._session_queue: Optional[asyncio.Queue] = None
+        self._session_worker_task: Optional[asyncio.Task] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        
+        # Exact and semantic cache of RAG responses, persisted next to the PDFs
+        self._rag_cache = _RagResponseCache(
+            cache_dir=os.path.join(os.path.dirname(self.pdf_dir), "rag_cache"),
+            ttl_seconds=RAG_CACHE_TTL_SECONDS,
+            threshold=RAG_SEMANTIC_THRESHOLD,
+        )
+        self._embedding_cache = _EmbeddingCache(os.path.join(os.path.dirname(self.pdf_dir), "embed_cache.db"))
+        
+        # PDF styles are request-invariant, build them once
+        self._init_pdf_styles()
+        
         # Worksheet type prompts to guide generation
         self._worksheet_type_prompts = {
             WorksheetType.MULTIPLE_CHOICE: {
@@ -55,6 +365,71 @@ class WorksheetGeneratorService:
                 "example": "1. Explain how photosynthesis works in plants."
             }
         }
+        
+        # Prompts with the worksheet-type text already filled in, and generation configs by output budget
+        self._prompt_templates = {
+            worksheet_type: self._build_prompt_template(worksheet_type)
+            for worksheet_type in self._worksheet_type_prompts
+        }
+        self._rag_configs: Dict[int, types.GenerateContentConfig] = {}
+        
+        # Pay reportlab font loading before the first request; the model is warmed from the app lifespan
+        threading.Thread(target=self._warmup, name="worksheet-warmup", daemon=True).start()
+    
+    def _warmup(self):
+        """Build a throwaway PDF so first requests hit warm reportlab paths."""
+        started = time.perf_counter()
+        try:
+            doc = SimpleDocTemplate(io.BytesIO(), pagesize=letter)
+            doc.build([Paragraph("x", self._title_style), Paragraph("x", self._normal_style)])
+        except Exception as e:
+            logger.warning(f"Worksheet PDF warmup failed: {e}")
+        
+        logger.info(f"Worksheet PDF warmup finished in {(time.perf_counter() - started) * 1000.0:.1f}ms")
+    
+    async def warmup_model(self):
+        """Issue a tiny call through the async client on the serving loop, so RAG requests find its connection warm."""
+        if not self.genai_client:
+            return
+        
+        started = time.perf_counter()
+        try:
+            await self.genai_client.aio.models.generate_content(
+                model=self.model_name,
+                contents="ping",
+                config=types.GenerateContentConfig(max_output_tokens=8),
+            )
+            logger.info(f"Worksheet model warmup finished in {(time.perf_counter() - started) * 1000.0:.1f}ms")
+        except Exception as e:
+            logger.warning(f"Worksheet model warmup failed: {e}")
+    
+    def _init_pdf_styles(self):
+        """Build the reportlab paragraph styles shared by every worksheet PDF."""
+        styles = getSampleStyleSheet()
+        
+        self._title_style = ParagraphStyle(
+            'Title',
+            parent=styles['Title'],
+            alignment=TA_CENTER,
+            fontSize=16,
+            spaceAfter=12
+        )
+        
+        self._header_style = ParagraphStyle(
+            'Header',
+            parent=styles['Heading2'],
+            fontSize=14,
+            spaceAfter=10
+        )
+        
+        self._normal_style = ParagraphStyle(
+            'Normal',
+            parent=styles['Normal'],
+            fontSize=11,
+            spaceAfter=8
+        )
+        
+        self._subtitle_style = styles['Italic']
     
     def _init_genai_client(self):
         """Initialize the Google AI Generative client."""
@@ -66,61 +441,67 @@ class WorksheetGeneratorService:
                 location="global",
             )
             self.model_name = "gemini-2.5-flash-lite"
+            self.embedding_client = genai.Client(
+                vertexai=True,
+                project="purva-api",
+                location=EMBEDDING_LOCATION,
+            )
             logger.info("Google Generative AI client initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Google Generative AI client: {e}")
             self.genai_client = None
+            self.embedding_client = None
     
     async def generate_worksheet(self, 
                                 request: WorksheetRequest,
                                 user_id: Optional[str] = None) -> WorksheetResponse:
         """Generate a worksheet based on the provided parameters."""
+        response, _ = await self.generate_worksheet_file(request, user_id)
+        return response
+    
+    async def generate_worksheet_file(self,
+                                     request: WorksheetRequest,
+                                     user_id: Optional[str] = None) -> Tuple[WorksheetResponse, str]:
+        """Generate a worksheet and return the response together with the local PDF path."""
         try:
-            session_id = None
-            
-            # Check session if user_id is provided
-            if user_id:
-                try:
-                    # Validate user session
-                    session = session_service.get_session(user_id)
-                    session_id = session.session_id
-                    logger.info(f"Using session {session_id} for user: {user_id}")
-                except Exception as session_error:
-                    logger.warning(f"Invalid user_id for session: {session_error}")
-                    # Create a new session for this user
-                    try:
-                        session_id = session_service.create_session(user_id)
-                        logger.info(f"Created new session {session_id} for user: {user_id}")
-                    except Exception as create_error:
-                        logger.error(f"Failed to create session: {create_error}")
-            
-            # Retrieve content from RAG based on subject, grade, topic
-            rag_content = self._retrieve_rag_content(
-                subject=request.subject,
-                grade=request.grade,
-                topic=request.topic,
-                worksheet_type=request.worksheet_type,
-                num_questions=request.num_questions,
-                language=request.language
-            )
-            
-            if not rag_content:
-                raise Exception("Failed to retrieve content from RAG system")
-            
-            # Generate worksheet content using the RAG response
-            worksheet_content = self._process_rag_response(
-                rag_content, 
-                request.worksheet_type, 
-                include_answers=request.include_answers
-            )
-            
-            # Generate PDF from content
-            pdf_path, pdf_url = self._generate_pdf(
-                worksheet_content=worksheet_content,
-                request=request
-            )
+            # Identical requests on the same day reuse the PDF already built for them
+            pdf_cache_key = self._pdf_cache_key(request)
+            cached_pdf = self._cached_pdf(pdf_cache_key)
+            if cached_pdf:
+                logger.info(f"Using cached worksheet PDF for {request.subject}, grade {request.grade}, topic {request.topic}")
+                session_id = await self._resolve_session_id(user_id)
+                pdf_path, pdf_url = cached_pdf
+            else:
+                # Resolve the session while the RAG content is being retrieved
+                session_id, rag_content = await asyncio.gather(
+                    self._resolve_session_id(user_id),
+                    self._retrieve_rag_content(
+                        subject=request.subject,
+                        grade=request.grade,
+                        topic=request.topic,
+                        worksheet_type=request.worksheet_type,
+                        num_questions=request.num_questions,
+                        language=request.language
+                    ),
+                )
+                
+                if not rag_content:
+                    raise Exception("Failed to retrieve content from RAG system")
+                
+                # Generate worksheet content using the RAG response
+                worksheet_content = self._process_rag_response(
+                    rag_content, 
+                    request.worksheet_type, 
+                    include_answers=request.include_answers
+                )
+                
+                # Generate PDF from content off the event loop, reportlab is CPU-bound
+                pdf_path, pdf_url = await asyncio.to_thread(self._generate_pdf, worksheet_content, request)
+                
+                # Only validated replies get this far, so error worksheets are never cached
+                await asyncio.to_thread(self._store_pdf, pdf_cache_key, pdf_path)
             
-            # Update session with worksheet information if session exists
+            # Update session with worksheet information if session exists, without holding up the response
             if session_id and user_id:
                 metadata = {
                     "worksheet_type": request.worksheet_type,
@@ -131,16 +512,12 @@ class WorksheetGeneratorService:
                     "timestamp": datetime.now().isoformat()
                 }
                 
-                try:
-                    session_service.add_message(
-                        user_id=user_id,
-                        content=f"Generated {request.worksheet_type} worksheet for {request.subject}, grade {request.grade}, topic: {request.topic}",
-                        agent_type="worksheet_generator",
-                        metadata=metadata
-                    )
-                    logger.info(f"Updated session {session_id} with worksheet generation event")
-                except Exception as e:
-                    logger.error(f"Failed to update session with worksheet info: {e}")
+                self._enqueue_session_update(
+                    user_id=user_id,
+                    session_id=session_id,
+                    content=f"Generated {request.worksheet_type} worksheet for {request.subject}, grade {request.grade}, topic: {request.topic}",
+                    metadata=metadata
+                )
             
             # Create and return response
             worksheet_title = request.title or f"{request.subject} {request.topic} {request.worksheet_type.value.replace('_', ' ').title()} Worksheet"
@@ -156,13 +533,133 @@ class WorksheetGeneratorService:
             )
             
             logger.info(f"Successfully generated {request.worksheet_type} worksheet for {request.subject}, grade {request.grade}")
-            return response
+            return response, pdf_path
             
         except Exception as e:
             logger.error(f"Error generating worksheet: {e}")
             raise Exception(f"Failed to generate worksheet: {str(e)}")
     
-    def _retrieve_rag_content(self, 
+    def _pdf_cache_key(self, request: WorksheetRequest) -> str:
+        """SHA-256 of every request field that shapes the PDF, plus the date printed on it."""
+        canonical = request.model_dump_json(exclude={"user_id"})
+        return hashlib.sha256(f"{canonical}|{datetime.now().date().isoformat()}".encode("utf-8")).hexdigest()
+    
+    def _cached_pdf(self, key: str) -> Optional[Tuple[str, str]]:
+        """Path and URL of a previously built PDF for this key, if one exists."""
+        filepath = os.path.join(self.pdf_cache_dir, f"{key}.pdf")
+        if os.path.exists(filepath):
+            return filepath, f"/generated_pdfs/cache/{key}.pdf"
+        return None
+    
+    def _store_pdf(self, key: str, pdf_path: str) -> None:
+        """Add a freshly built PDF to the content-addressed cache without copying it where possible."""
+        cache_path = os.path.join(self.pdf_cache_dir, f"{key}.pdf")
+        try:
+            os.link(pdf_path, cache_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            try:
+                # Copy under a temporary name so readers never see a partial file
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                shutil.copyfile(pdf_path, tmp_path)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.warning(f"Could not cache worksheet PDF {pdf_path}: {e}")
+        
+        self._prune_disk_caches()
+    
+    def _prune_disk_caches(self) -> None:
+        """
+        At most once per interval, delete RAG cache files past their TTL and cached PDFs
+        past the age cap, then the oldest PDFs beyond the count cap.
+        """
+        now = time.time()
+        if now - self._pdf_cache_pruned_at < PDF_CACHE_PRUNE_INTERVAL_SECONDS:
+            return
+        self._pdf_cache_pruned_at = now
+        
+        rag_removed = self._rag_cache.prune_disk()
+        if rag_removed:
+            logger.info(f"Pruned {rag_removed} expired RAG cache entries")
+        
+        try:
+            with os.scandir(self.pdf_cache_dir) as it:
+                entries = sorted(
+                    ((entry.stat().st_mtime, entry.path) for entry in it if entry.name.endswith(".pdf")),
+                    reverse=True
+                )
+        except OSError as e:
+            logger.warning(f"Could not scan worksheet PDF cache: {e}")
+            return
+        
+        removed = 0
+        for position, (mtime, path) in enumerate(entries):
+            if position >= PDF_CACHE_MAX_FILES or now - mtime > PDF_CACHE_MAX_AGE_SECONDS:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f"Pruned {removed} cached worksheet PDFs")
+    
+    async def _resolve_session_id(self, user_id: Optional[str]) -> Optional[str]:
+        """Get the user's session id, creating a session if needed; None without a user or on failure."""
+        if not user_id:
+            return None
+        
+        try:
+            # Validate user session
+            session = await session_service.get_session_async(user_id)
+            logger.info(f"Using session {session.session_id} for user: {user_id}")
+            return session.session_id
+        except Exception as session_error:
+            logger.warning(f"Invalid user_id for session: {session_error}")
+            # Create a new session for this user
+            try:
+                session = await asyncio.to_thread(session_service.create_session, user_id)
+                logger.info(f"Created new session {session.session_id} for user: {user_id}")
+                return session.session_id
+            except Exception as create_error:
+                logger.error(f"Failed to create session: {create_error}")
+                return None
+    
+    def _enqueue_session_update(self, user_id: str, session_id: str, content: str, metadata: Dict[str, Any]) -> None:
+        """Queue a session history update for the background worker."""
+        loop = asyncio.get_running_loop()
+        if self._session_loop is not loop:
+            # Queues and tasks belong to one event loop, start fresh on a new one
+            self._session_loop = loop
+            self._session_queue = asyncio.Queue()
+            self._session_worker_task = None
+        if self._session_worker_task is None or self._session_worker_task.done():
+            self._session_worker_task = loop.create_task(self._session_worker())
+        self._session_queue.put_nowait((user_id, session_id, content, metadata))
+    
+    async def _session_worker(self) -> None:
+        """Drain queued session updates one at a time."""
+        while True:
+            user_id, session_id, content, metadata = await self._session_queue.get()
+            try:
+                await self._record_worksheet_message(user_id, session_id, content, metadata)
+            finally:
+                self._session_queue.task_done()
+    
+    async def _record_worksheet_message(self, user_id: str, session_id: str, content: str, metadata: Dict[str, Any]) -> None:
+        """Add the worksheet generation event to the user's session history."""
+        try:
+            await session_service.add_message_async(
+                user_id=user_id,
+                content=content,
+                agent_type="worksheet_generator",
+                metadata=metadata
+            )
+            logger.info(f"Updated session {session_id} with worksheet generation event")
+        except Exception as e:
+            logger.error(f"Failed to update session with worksheet info: {e}")
+    
+    async def _retrieve_rag_content(self, 
                              subject: str, 
                              grade: str, 
                              topic: str, 
@@ -173,149 +670,274 @@ class WorksheetGeneratorService:
         try:
             if not self.genai_client:
                 logger.error("Google Generative AI client not initialized")
-                return "Failed to initialize AI client for content generation."
-            
-            # Create the prompt for RAG
-            type_info = self._worksheet_type_prompts[worksheet_type]
-            
-            prompt = f"""
-You are an expert educational worksheet creator for grade {grade} students.
-Create a complete {worksheet_type.value.replace('_', ' ')} worksheet about {topic} for {subject}.
-
-{type_info['instruction'].format(num_questions=num_questions)}
-{type_info['format']}
-
-The worksheet must include exactly {num_questions} questions related to {topic} in {subject} appropriate for grade {grade} students.
-Make sure all questions are factually correct and aligned with educational standards.
-
-For each question, also provide the correct answer separately in an answer key section.
-
-Language: {language}
-            """
-            
-            # Configure the RAG request
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[types.Part(text=prompt)]
-                )
-            ]
+                return ""
             
-            tools = [
-                types.Tool(
-                    retrieval=types.Retrieval(
-                        vertex_rag_store=types.VertexRagStore(
-                            rag_resources=[
-                                types.VertexRagStoreRagResource(
-                                    rag_corpus="projects/purva-api/locations/us-central1/ragCorpora/4611686018427387904"
-                                )
-                            ],
-                            similarity_top_k=20,
-                        )
-                    )
-                )
-            ]
+            # Serve repeated and near-identical requests from the cache
+            cache_key = self._rag_cache_key(subject, grade, topic, worksheet_type, num_questions, language)
+            cached = await asyncio.to_thread(self._rag_cache.get_exact, cache_key)
+            if cached is not None:
+                logger.info(f"Using cached RAG content for {subject}, grade {grade}, topic {topic}")
+                return cached
+            
+            shape = (str(grade).strip().lower(), worksheet_type.value, num_questions, language.strip().lower())
+            query_embedding = await self._embed_query(f"{subject}: {topic}")
+            if query_embedding is not None:
+                cached = await asyncio.to_thread(self._rag_cache.get_similar, shape, query_embedding)
+                if cached is not None:
+                    logger.info(f"Using semantically cached RAG content for {subject}, grade {grade}, topic {topic}")
+                    return cached
             
-            # Configure generation parameters
-            generate_content_config = types.GenerateContentConfig(
-                temperature=0.2,  # Lower temperature for more factual/consistent output
-                top_p=0.95,
-                max_output_tokens=65535,
-                safety_settings=[
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HATE_SPEECH",
-                        threshold="OFF"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                        threshold="OFF"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                        threshold="OFF"
-                    ),
-                    types.SafetySetting(
-                        category="HARM_CATEGORY_HARASSMENT",
-                        threshold="OFF"
-                    )
-                ],
-                tools=tools,
+            # Create the prompt for RAG
+            prompt = self._prompt_templates[worksheet_type].format(
+                grade=grade,
+                topic=topic,
+                subject=subject,
+                num_questions=num_questions,
+                language=language
             )
             
             # Call the RAG system
             logger.info(f"Calling RAG system for {subject}, grade {grade}, topic {topic}")
-            response = self.genai_client.models.generate_content(
-                model=self.model_name,
-                contents=contents,
-                config=generate_content_config,
-            )
-            
-            if response and response.candidates and response.candidates[0].content:
-                content = response.candidates[0].content.parts[0].text
+            max_output_tokens = self._max_output_tokens(num_questions, language)
+            try:
+                content = await self._generate_rag_content(prompt, subject, grade, max_output_tokens)
+            except _TruncatedRagResponse:
+                if max_output_tokens >= MAX_OUTPUT_TOKENS:
+                    raise
+                # A cut-off JSON reply is unusable, retry once with room to finish
+                logger.warning(f"RAG response hit the {max_output_tokens} token limit, retrying with a larger budget")
+                max_output_tokens = min(MAX_OUTPUT_TOKENS, 2 * max_output_tokens)
+                content = await self._generate_rag_content(prompt, subject, grade, max_output_tokens)
+            
+            if content and not self._is_valid_rag_content(content):
+                # Only a reply in the requested JSON shape can be rendered, ask once more
+                logger.warning(f"RAG response for {subject}, grade {grade}, topic {topic} did not validate, retrying once")
+                content = await self._generate_rag_content(prompt, subject, grade, max_output_tokens)
+                if content and not self._is_valid_rag_content(content):
+                    logger.error(f"RAG response for {subject}, grade {grade}, topic {topic} did not validate after a retry")
+                    return ""
+            
+            if content:
                 logger.info(f"Successfully retrieved content from RAG (length: {len(content)} chars)")
+                await asyncio.to_thread(self._rag_cache.put, cache_key, shape, query_embedding, content)
                 return content
             else:
                 logger.error("Empty response from RAG system")
                 return ""
                 
+        except _TruncatedRagResponse as e:
+            logger.error(f"RAG response for {subject}, grade {grade}, topic {topic} was truncated: {e}")
+            return ""
         except Exception as e:
             logger.error(f"Error retrieving content from RAG: {e}")
             return ""
     
+    async def _generate_rag_content(self, prompt: str, subject: str, grade: str, max_output_tokens: int) -> str:
+        """Run (or join an identical in-flight) RAG call with the given output budget."""
+        config = self._rag_generate_config(subject, grade, max_output_tokens)
+        return await self._rag_coalescer.submit((prompt, max_output_tokens), prompt, config)
+    
+    def _build_prompt_template(self, worksheet_type: WorksheetType) -> str:
+        """Full RAG prompt for a worksheet type, leaving only the per-request fields as placeholders."""
+        type_info = self._worksheet_type_prompts[worksheet_type]
+        return f"""
+You are an expert educational worksheet creator for grade {{grade}} students.
+Create a complete {worksheet_type.value.replace('_', ' ')} worksheet about {{topic}} for {{subject}}.
+
+{type_info['instruction']}
+{type_info['format']}
+
+The worksheet must include exactly {{num_questions}} questions related to {{topic}} in {{subject}} appropriate for grade {{grade}} students.
+Make sure all questions are factually correct and aligned with educational standards.
+
+For each question, also provide the correct answer in its "answer" field.
+
+Language: {{language}}
+
+{_JSON_RESPONSE_FORMAT}
+            """
+    
+    def _rag_generate_config(self, subject: str, grade: str, max_output_tokens: int) -> types.GenerateContentConfig:
+        """Generation config for a RAG call; without metadata filtering it only varies by output budget."""
+        if WORKSHEET_RAG_METADATA_FILTER:
+            return self._make_rag_generate_config(subject, grade, max_output_tokens)
+        
+        config = self._rag_configs.get(max_output_tokens)
+        if config is None:
+            config = self._rag_configs.setdefault(
+                max_output_tokens, self._make_rag_generate_config(subject, grade, max_output_tokens)
+            )
+        return config
+    
+    def _make_rag_generate_config(self, subject: str, grade: str, max_output_tokens: int) -> types.GenerateContentConfig:
+        """Build the RAG tool and generation config for a request."""
+        tools = [
+            types.Tool(
+                retrieval=types.Retrieval(
+                    vertex_rag_store=types.VertexRagStore(
+                        rag_resources=[
+                            types.VertexRagStoreRagResource(
+                                rag_corpus="projects/purva-api/locations/us-central1/ragCorpora/4611686018427387904"
+                            )
+                        ],
+                        rag_retrieval_config=self._rag_retrieval_config(subject, grade),
+                    )
+                )
+            )
+        ]
+        
+        return types.GenerateContentConfig(
+            temperature=0.2,  # Lower temperature for more factual/consistent output
+            top_p=0.95,
+            max_output_tokens=max_output_tokens,
+            safety_settings=self._SAFETY_SETTINGS,
+            tools=tools,
+        )
+    
+    def _max_output_tokens(self, num_questions: int, language: str) -> int:
+        """Output token limit sized to the worksheet and its script instead of the model maximum."""
+        if language.strip().lower() in _LATIN_SCRIPT_LANGUAGES:
+            per_question = TOKENS_PER_QUESTION
+        else:
+            per_question = TOKENS_PER_QUESTION_NON_LATIN
+        return min(MAX_OUTPUT_TOKENS, num_questions * per_question + BASE_OUTPUT_TOKENS)
+    
+    def _rag_retrieval_config(self, subject: str, grade: str) -> types.RagRetrievalConfig:
+        """Retrieval settings: a small top-k, optionally prefiltered by subject and grade metadata."""
+        retrieval_filter = None
+        if WORKSHEET_RAG_METADATA_FILTER:
+            retrieval_filter = types.RagRetrievalConfigFilter(
+                metadata_filter=f"subject = {json.dumps(subject.strip())} AND grade = {json.dumps(str(grade).strip())}"
+            )
+        return types.RagRetrievalConfig(top_k=WORKSHEET_RAG_TOP_K, filter=retrieval_filter)
+    
+    async def _call_rag_model(self, prompt: str, config: types.GenerateContentConfig) -> str:
+        """Issue a single RAG-grounded call, streaming the text in; raises _TruncatedRagResponse at the token limit."""
+        contents = [
+            types.Content(
+                role="user",
+                parts=[types.Part(text=prompt)]
+            )
+        ]
+        stream = await self.genai_client.aio.models.generate_content_stream(
+            model=self.model_name,
+            contents=contents,
+            config=config,
+        )
+        
+        chunks = []
+        finish_reason = None
+        async for chunk in stream:
+            if not chunk.candidates:
+                continue
+            candidate = chunk.candidates[0]
+            if candidate.content and candidate.content.parts:
+                chunks.extend(part.text for part in candidate.content.parts if part.text)
+            # Only the final chunk carries the finish reason
+            finish_reason = candidate.finish_reason or finish_reason
+        
+        if finish_reason == types.FinishReason.MAX_TOKENS:
+            raise _TruncatedRagResponse(f"stopped at max_output_tokens={config.max_output_tokens}")
+        return "".join(chunks)
+    
+    def _rag_cache_key(self,
+                       subject: str,
+                       grade: str,
+                       topic: str,
+                       worksheet_type: WorksheetType,
+                       num_questions: int,
+                       language: str) -> str:
+        """SHA-256 of the canonicalised request fields that determine the RAG response."""
+        canonical = json.dumps([
+            subject.strip().lower(),
+            str(grade).strip().lower(),
+            topic.strip().lower(),
+            worksheet_type.value,
+            num_questions,
+            language.strip().lower(),
+        ], ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    
+    async def _embed_query(self, text: str) -> Optional[np.ndarray]:
+        """Embed a cache query as an L2-normalised float32 vector, or None if embedding fails."""
+        normalized = _EmbeddingCache.normalize(text)
+        key = _EmbeddingCache.key(normalized)
+        vector = await asyncio.to_thread(self._embedding_cache.get, key)
+        if vector is not None:
+            return vector
+        
+        # Embedding recently failed: go straight to generation rather than waiting on another failure
+        if not self.embedding_client or time.monotonic() < self._embedding_disabled_until:
+            return None
+        
+        try:
+            response = await asyncio.wait_for(
+                self.embedding_client.aio.models.embed_content(
+                    model=EMBEDDING_MODEL,
+                    contents=normalized,
+                ),
+                EMBEDDING_TIMEOUT_SECONDS,
+            )
+            vector = np.asarray(response.embeddings[0].values, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if not norm:
+                return None
+            vector = vector / norm
+            await asyncio.to_thread(self._embedding_cache.put, key, vector)
+            return vector
+        except Exception as e:
+            self._embedding_disabled_until = time.monotonic() + EMBEDDING_FAILURE_BACKOFF_SECONDS
+            logger.warning(f"Could not embed RAG cache query, skipping the semantic cache for {EMBEDDING_FAILURE_BACKOFF_SECONDS}s: {e}")
+            return None
+    
+    def _is_valid_rag_content(self, content: str) -> bool:
+        """Whether a RAG reply is a complete worksheet in the requested JSON shape."""
+        try:
+            data = WorksheetContent.model_validate_json(_unfence(content))
+        except ValueError:
+            return False
+        return bool(data.questions)
+    
     def _process_rag_response(self, 
                              rag_content: str, 
                              worksheet_type: WorksheetType,
                              include_answers: bool = True) -> Dict[str, Any]:
-        """Process the RAG response into a structured format for PDF generation."""
+        """Process the JSON RAG response into a structured format for PDF generation."""
+        structured = self._process_structured_response(_unfence(rag_content), worksheet_type, include_answers)
+        if structured is None:
+            raise ValueError("RAG response is not a valid worksheet")
+        return structured
+    
+    def _process_structured_response(self,
+                                     rag_content: str,
+                                     worksheet_type: WorksheetType,
+                                     include_answers: bool) -> Optional[Dict[str, Any]]:
+        """Build the PDF content from a JSON response, or None if it doesn't validate."""
         try:
-            # Split content into questions and answers
-            parts = rag_content.split("Answer Key", 1)
-            
-            questions_section = parts[0].strip()
-            answers_section = parts[1].strip() if len(parts) > 1 and include_answers else ""
-            
-            # Extract title from the beginning if present
-            title_lines = questions_section.split('\n', 3)
-            title = title_lines[0].strip()
-            if len(title_lines) > 1 and not title_lines[1].strip():
-                # Use the first line as title if followed by empty line
-                questions_section = '\n'.join(title_lines[2:])
-            else:
-                # Default title will be used instead
-                title = ""
-            
-            # Parse questions based on worksheet type
-            questions = []
-            
-            # Split by numbered lines (1., 2., etc.)
-            import re
-            question_blocks = re.split(r'\n\s*\d+\.', questions_section)
-            if len(question_blocks) > 1:
-                # Remove any content before the first question
-                question_blocks = question_blocks[1:]
-                
-                for q in question_blocks:
-                    questions.append(q.strip())
+            data = WorksheetContent.model_validate_json(rag_content)
+        except ValueError as e:
+            logger.warning(f"Structured worksheet response did not validate: {e}")
+            return None
+        
+        # Model text goes into reportlab Paragraph markup, so escape it before joining with <br/>
+        questions = []
+        for item in data.questions:
+            if item.options:
+                labelled = [f"{chr(ord('A') + i)}) {escape(option)}" for i, option in enumerate(item.options)]
+                questions.append("<br/>".join([escape(item.question), *labelled]))
             else:
-                # Alternative split method if numbered format not found
-                questions = [q.strip() for q in questions_section.split('\n\n') if q.strip()]
-            
-            # Structure content for PDF generation
-            return {
-                "title": title,
-                "questions": questions,
-                "answers": answers_section if include_answers else "",
-                "worksheet_type": worksheet_type
-            }
-            
-        except Exception as e:
-            logger.error(f"Error processing RAG response: {e}")
-            return {
-                "title": "Error in processing worksheet content",
-                "questions": ["Error: Could not process the worksheet content correctly."],
-                "answers": "",
-                "worksheet_type": worksheet_type
-            }
+                questions.append(escape(item.question))
+        
+        answers = ""
+        if include_answers:
+            answers = "<br/>".join(f"{i}. {escape(item.answer)}" for i, item in enumerate(data.questions, 1))
+        
+        return {
+            "title": escape(data.title.strip()),
+            "questions": questions,
+            "answers": answers,
+            "worksheet_type": worksheet_type
+        }
     
     def _generate_pdf(self, 
                      worksheet_content: Dict[str, Any], 
@@ -323,12 +945,12 @@ Language: {language}
         """Generate a PDF worksheet from the processed content."""
         try:
             # Create a unique filename
-            timestamp = int(time.time())
-            unique_id = str(uuid.uuid4())[:8]
+            timestamp = time.time_ns()
+            unique_id = os.urandom(4).hex()
             
             # Create filename using subject, topic and timestamp
-            subject_slug = request.subject.replace(" ", "_").lower()
-            topic_slug = request.topic.replace(" ", "_").lower()
+            subject_slug = _slugify(request.subject)
+            topic_slug = _slugify(request.topic)
             worksheet_type = request.worksheet_type.value
             
             filename = f"worksheet_{subject_slug}_{topic_slug}_{worksheet_type}_{timestamp}_{unique_id}.pdf"
@@ -336,67 +958,38 @@ Language: {language}
             
             # Create the PDF
             doc = SimpleDocTemplate(filepath, pagesize=letter)
-            styles = getSampleStyleSheet()
-            
-            # Create custom styles
-            title_style = ParagraphStyle(
-                'Title',
-                parent=styles['Title'],
-                alignment=TA_CENTER,
-                fontSize=16,
-                spaceAfter=12
-            )
-            
-            header_style = ParagraphStyle(
-                'Header',
-                parent=styles['Heading2'],
-                fontSize=14,
-                spaceAfter=10
-            )
-            
-            normal_style = ParagraphStyle(
-                'Normal',
-                parent=styles['Normal'],
-                fontSize=11,
-                spaceAfter=8
-            )
             
             # Create document elements
             elements = []
             
             # Add custom title or use generated title
             title_text = request.title or worksheet_content.get("title") or f"{request.subject} - {request.topic} - {request.worksheet_type.value.replace('_', ' ').title()} Worksheet"
-            elements.append(Paragraph(title_text, title_style))
+            elements.append(Paragraph(title_text, self._title_style))
             
             # Add subtitle with grade info
             subtitle = f"Grade {request.grade} - {datetime.now().strftime('%B %d, %Y')}"
-            elements.append(Paragraph(subtitle, styles['Italic']))
+            elements.append(Paragraph(subtitle, self._subtitle_style))
             elements.append(Spacer(1, 20))
             
             # Add instructions based on worksheet type
-            if request.worksheet_type == WorksheetType.MULTIPLE_CHOICE:
-                instructions = "Instructions: Circle the letter of the correct answer for each question."
-            elif request.worksheet_type == WorksheetType.FILL_IN_BLANKS:
-                instructions = "Instructions: Fill in the blanks with the correct word or phrase."
-            else:  # SHORT_ANSWERS
-                instructions = "Instructions: Answer each question with complete sentences."
+            instructions = _INSTRUCTIONS[request.worksheet_type]
             
-            elements.append(Paragraph(instructions, normal_style))
+            elements.append(Paragraph(instructions, self._normal_style))
             elements.append(Spacer(1, 20))
             
             # Add questions
-            elements.append(Paragraph("Questions:", header_style))
+            elements.append(Paragraph("Questions:", self._header_style))
             
             for i, question in enumerate(worksheet_content["questions"]):
                 # Add question number
                 q_text = f"{i+1}. {question}"
-                elements.append(Paragraph(q_text, normal_style))
+                elements.append(Paragraph(q_text, self._normal_style))
                 elements.append(Spacer(1, 10))
             
             # Add answers if included
             if worksheet_content["answers"] and request.include_answers:
-                elements.append(Paragraph("Answer Key:", header_style))
-                elements.append(Paragraph(worksheet_content["answers"], normal_style))
+                elements.append(Paragraph("Answer Key:", self._header_style))
+                elements.append(Paragraph(worksheet_content["answers"], self._normal_style))
             
             # Build the PDF
             doc.build(elements)
@@ -1,7 +1,89 @@
 from app.models.agent_model import Language
 from app.utils.logger import logger
 import re
-from typing import Optional
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# Grade/class number in English, Hindi and Gujarati queries
+_GRADE_RE = re.compile(r'(?:grade|class|कक्षा|વર્ગ)\s*(\d+)')
+
+# Word characters; \w alone splits Indic words at their combining vowel signs, so include those script blocks
+_WORD_CHARS = r'\w\u0900-\u0DFF'
+
+_CONTENT_TYPE_KEYWORDS = {
+    'story': ['story', 'stories', 'कहानी', 'कथा', 'વાર્તા'],
+    'explanation': ['explain', 'explanation', 'व्याख्या'],
+    'example': ['example', 'उदाहरण', 'દાખલો'],
+    'activity': ['activity', 'activities', 'गतिविधि', 'પ્રવૃત્તિ'],
+}
+
+_SUBJECT_KEYWORDS = {
+    'science': ['science', 'विज्ञान', 'વિજ્ઞાન', 'soil', 'water', 'plants'],
+    'math': ['math', 'mathematics', 'गणित', 'ગણિત', 'numbers', 'counting'],
+    'social': ['social', 'समाजिक', 'સામાજિક', 'farmers', 'community', 'history'],
+    'language': ['language', 'भाषा', 'ભાષા', 'reading', 'writing', 'grammar']
+}
+
+
+def _rank_keywords(table: dict) -> dict:
+    """Map each keyword to (priority, label), where earlier labels in the table have priority."""
+    ranked = {}
+    for rank, (label, keywords) in enumerate(table.items()):
+        for keyword in keywords:
+            ranked.setdefault(keyword, (rank, label))
+    return ranked
+
+
+def _word_prefix_pattern(ranked: dict) -> re.Pattern:
+    """Pattern matching any keyword at the start of a word, so inflections ("explaining", "examples") still match"""
+    alternation = '|'.join(re.escape(keyword) for keyword in sorted(ranked, key=len, reverse=True))
+    return re.compile(f'(?<![{_WORD_CHARS}])(?:{alternation})')
+
+
+_CONTENT_TYPE_MAP = _rank_keywords(_CONTENT_TYPE_KEYWORDS)
+_SUBJECT_MAP = _rank_keywords(_SUBJECT_KEYWORDS)
+_CONTENT_TYPE_RE = _word_prefix_pattern(_CONTENT_TYPE_MAP)
+_SUBJECT_RE = _word_prefix_pattern(_SUBJECT_MAP)
+
+
+def _first_match(text: str, pattern: re.Pattern, ranked: dict) -> Optional[str]:
+    """Highest-priority label with a keyword starting a word of the text"""
+    hits = [ranked[keyword] for keyword in pattern.findall(text)]
+    return min(hits)[1] if hits else None
+
+
+# Cloud Translation language codes to language names
+_LANGUAGE_NAMES = {
+    "en": "English",
+    "hi": "Hindi",
+    "gu": "Gujarati",
+    "mr": "Marathi",
+    "te": "Telugu",
+    "ta": "Tamil",
+    "kn": "Kannada",
+    "bn": "Bengali",
+    "pa": "Punjabi",
+    "ur": "Urdu",
+    "ml": "Malayalam",
+    "or": "Odia"
+}
+
+# Lowercase language names to Cloud Translation language codes, derived so the maps can't drift
+_LANGUAGE_CODES = {name.lower(): code for code, name in _LANGUAGE_NAMES.items()}
+
+# Cloud Translation recommends at most 5K code points per request (100K hard limit) and accepts
+# 128 segments. Long texts are split into chunks of _MAX_TRANSLATE_CHARS, and each request
+# carries segments up to _MAX_REQUEST_CHARS in total.
+_MAX_TRANSLATE_CHARS = 4500
+_MAX_REQUEST_CHARS = 5000
+_MAX_TRANSLATE_SEGMENTS = 128
+
+# Whitespace after a sentence end (including the Devanagari danda), or a line break
+_CHUNK_BOUNDARY_RE = re.compile(r'(?<=[.!?।])\s+|\n\s*')
+
+# Created lazily by _get_translate_client
+_translate_client = None
+
 
 class LanguageDetector:
     """Simple language detection utility for Indian languages"""
@@ -24,21 +106,40 @@ class LanguageDetector:
             'story', 'create', 'explain', 'teacher', 'student', 'class', 
             'about', 'farmers', 'soil', 'types', 'generate'
         ]
+        
+        # Languages each keyword belongs to (some words are shared, e.g. Hindi and Marathi)
+        self._keyword_languages = {}
+        for language, keywords in self.language_keywords.items():
+            for keyword in keywords:
+                self._keyword_languages.setdefault(keyword, []).append(language)
+        
+        # One alternation per script family so the input is scanned once; longest keywords first
+        self._keyword_re = self._compile_alternation(self._keyword_languages)
+        self._english_re = self._compile_alternation(self.english_indicators)
+        
+        # Ties between languages go to the one listed first, as with the original ordered scan
+        self._language_rank = {language: rank for rank, language in enumerate(self.language_keywords)}
+    
+    @staticmethod
+    def _compile_alternation(words) -> re.Pattern:
+        """Single pattern matching any of the words, preferring longer ones"""
+        return re.compile('|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True)))
     
     def detect_language(self, text: str) -> Language:
         """Detect language from text input"""
         try:
-            text_lower = text.lower()
+            # Check for non-English languages first, tallying keyword hits per language
+            hits = {}
+            for keyword in self._keyword_re.findall(text):
+                for language in self._keyword_languages[keyword]:
+                    hits[language] = hits.get(language, 0) + 1
+            if hits:
+                language = min(hits, key=lambda lang: (-hits[lang], self._language_rank[lang]))
+                logger.info(f"Detected language: {language.value} based on {hits[language]} keyword(s)")
+                return language
             
-            # Check for non-English languages first
-            for language, keywords in self.language_keywords.items():
-                for keyword in keywords:
-                    if keyword in text:
-                        logger.info(f"Detected language: {language.value} based on keyword: {keyword}")
-                        return language
-            
-            # Check for English indicators
-            english_count = sum(1 for indicator in self.english_indicators if indicator in text_lower)
+            # Check for English indicators; only these need case folding, Indic scripts have no case
+            english_count = len(set(self._english_re.findall(text.lower())))
             if english_count > 0:
                 logger.info(f"Detected language: English based on {english_count} indicators")
                 return Language.ENGLISH
@@ -51,62 +152,64 @@ class LanguageDetector:
             logger.error(f"Error in language detection: {e}")
             return Language.ENGLISH
 
-def detect_content_intent(query: str) -> dict:
-    """Detect the intent and extract parameters from the query"""
+@lru_cache(maxsize=1024)
+def _intent_cached(query: str) -> Tuple[str, str, Tuple[int, ...]]:
+    """Resolve (content_type, subject, grade_levels) for a query; hashable so repeated queries hit the cache"""
     query_lower = query.lower()
     
-    intent_data = {
-        "content_type": "story",
-        "subject": "general",
-        "grade_levels": [1, 2, 3, 4, 5],
-        "keywords": []
-    }
-    
-    # Detect content type
-    if any(word in query_lower for word in ['story', 'कहानी', 'कथा', 'વાર્તા']):
-        intent_data["content_type"] = "story"
-    elif any(word in query_lower for word in ['explain', 'explanation', 'व्याख्या']):
-        intent_data["content_type"] = "explanation"
-    elif any(word in query_lower for word in ['example', 'उदाहरण', 'દાખલો']):
-        intent_data["content_type"] = "example"
-    elif any(word in query_lower for word in ['activity', 'गतिविधि', 'પ્રવૃત્તિ']):
-        intent_data["content_type"] = "activity"
+    # Detect content type (earlier types win, as in the original if/elif order)
+    content_type = _first_match(query_lower, _CONTENT_TYPE_RE, _CONTENT_TYPE_MAP) or "story"
     
     # Detect subject areas
-    subjects = {
-        'science': ['science', 'विज्ञान', 'વિજ્ઞાન', 'soil', 'water', 'plants'],
-        'math': ['math', 'mathematics', 'गणित', 'ગણિત', 'numbers', 'counting'],
-        'social': ['social', 'समाजिक', 'સામાજિક', 'farmers', 'community', 'history'],
-        'language': ['language', 'भाषा', 'ભાષા', 'reading', 'writing', 'grammar']
-    }
-    
-    for subject, keywords in subjects.items():
-        if any(keyword in query_lower for keyword in keywords):
-            intent_data["subject"] = subject
-            break
+    subject = _first_match(query_lower, _SUBJECT_RE, _SUBJECT_MAP) or "general"
     
     # Extract grade information
-    grade_patterns = [
-        r'grade\s*(\d+)',
-        r'class\s*(\d+)',
-        r'कक्षा\s*(\d+)',
-        r'વર્ગ\s*(\d+)'
-    ]
+    matches = _GRADE_RE.findall(query_lower)
+    grade_levels = tuple(int(match) for match in matches) if matches else (1, 2, 3, 4, 5)
     
-    for pattern in grade_patterns:
-        matches = re.findall(pattern, query_lower)
-        if matches:
-            intent_data["grade_levels"] = [int(match) for match in matches]
-            break
+    return content_type, subject, grade_levels
+
+
+def detect_content_intent(query: str) -> dict:
+    """Detect the intent and extract parameters from the query"""
+    content_type, subject, grade_levels = _intent_cached(query)
     
-    return intent_data
+    # Build a fresh dict each call so callers can mutate it without touching the cache
+    return {
+        "content_type": content_type,
+        "subject": subject,
+        "grade_levels": list(grade_levels),
+        "keywords": []
+    }
+
 
+_SUPPORTED_LANGUAGES = frozenset({"english", "hindi", "gujarati", "marathi", "telugu", "tamil", "kannada", 
+                                  "bengali", "punjabi", "urdu", "malayalam", "odia"})
 
+
+@lru_cache(maxsize=1024)
 def is_language_supported(language: str) -> bool:
     """Check if the language is supported."""
-    supported_languages = ["english", "hindi", "gujarati", "marathi", "telugu", "tamil", "kannada", 
-                           "bengali", "punjabi", "urdu", "malayalam", "odia"]
-    return language.lower() in supported_languages
+    return language.lower() in _SUPPORTED_LANGUAGES
+
+
+def _get_translate_client():
+    """Shared Cloud Translation client, created on first use so auth and HTTP setup happen once"""
+    global _translate_client
+    if _translate_client is None:
+        from google.cloud import translate_v2 as translate
+        _translate_client = translate.Client()
+    return _translate_client
+
+
+@lru_cache(maxsize=4096)
+def _detect_language_cached(prefix: str) -> str:
+    """Detect the language of a text prefix via the API; raises on failure so errors are not cached"""
+    result = _get_translate_client().detect_language(prefix)
+    
+    detected = _LANGUAGE_NAMES.get(result["language"], "English")
+    logger.info(f"Detected language: {detected} with confidence {result['confidence']}")
+    return detected
 
 
 def detect_language(text: str) -> str:
@@ -120,31 +223,8 @@ def detect_language(text: str) -> str:
         The detected language name (e.g., "English", "Hindi", etc.)
     """
     try:
-        # Try to use Google Cloud Translation API if available
-        from google.cloud import translate_v2 as translate
-        
-        client = translate.Client()
-        result = client.detect_language(text[:500])  # Use first 500 chars for efficiency
-        
-        # Map language codes to full names
-        language_map = {
-            "en": "English",
-            "hi": "Hindi",
-            "gu": "Gujarati",
-            "mr": "Marathi",
-            "te": "Telugu",
-            "ta": "Tamil",
-            "kn": "Kannada",
-            "bn": "Bengali",
-            "pa": "Punjabi",
-            "ur": "Urdu",
-            "ml": "Malayalam",
-            "or": "Odia"
-        }
-        
-        detected = language_map.get(result["language"], "English")
-        logger.info(f"Detected language: {detected} with confidence {result['confidence']}")
-        return detected
+        # Use first 500 chars for efficiency; repeated prefixes are answered from the cache
+        return _detect_language_cached(text[:500])
         
     except Exception as e:
         logger.warning(f"Error detecting language: {e}. Defaulting to English.")
@@ -155,6 +235,9 @@ def translate_text(text: str, target_language: str) -> str:
     """
     Translate text to the target language using Google Cloud Translation API.
     
+    Text longer than the recommended request size is split at sentence or
+    line boundaries and the chunks are translated in requests of about that size.
+    
     Args:
         text: The text to translate
         target_language: The target language to translate to
@@ -165,31 +248,18 @@ def translate_text(text: str, target_language: str) -> str:
     try:
         if target_language.lower() == "english":
             return text
-            
-        # Try to use Google Cloud Translation API if available
-        from google.cloud import translate_v2 as translate
         
-        # Map common language names to language codes
-        language_code_map = {
-            "english": "en",
-            "hindi": "hi",
-            "gujarati": "gu",
-            "marathi": "mr",
-            "telugu": "te",
-            "tamil": "ta",
-            "kannada": "kn",
-            "bengali": "bn",
-            "punjabi": "pa",
-            "urdu": "ur",
-            "malayalam": "ml",
-            "odia": "or"
-        }
+        if len(text) > _MAX_TRANSLATE_CHARS:
+            chunks = _split_for_translation(text)
+            translated_chunks = _translate_batch([chunk for chunk, _ in chunks], target_language)
+            logger.info(f"Successfully translated text to {target_language} in {len(chunks)} chunks")
+            return "".join(translated + separator for translated, (_, separator) in zip(translated_chunks, chunks))
         
         # Get language code
-        target_code = language_code_map.get(target_language.lower(), target_language)
+        target_code = _LANGUAGE_CODES.get(target_language.lower(), target_language)
         
         # Translate text
-        client = translate.Client()
+        client = _get_translate_client()
         result = client.translate(text, target_language=target_code)
         
         translated_text = result["translatedText"]
@@ -200,3 +270,85 @@ def translate_text(text: str, target_language: str) -> str:
     except Exception as e:
         logger.error(f"Error translating text: {e}")
         return text  # Return original text if translation fails
+
+
+def translate_texts(texts: List[str], target_language: str) -> List[str]:
+    """
+    Translate several texts to the target language in as few API requests as possible.
+    
+    Args:
+        texts: The texts to translate
+        target_language: The target language to translate to
+        
+    Returns:
+        The translated texts, aligned with the input; the originals if translation fails
+    """
+    try:
+        if target_language.lower() == "english" or not texts:
+            return list(texts)
+        
+        translated = _translate_batch(texts, target_language)
+        logger.info(f"Successfully translated {len(texts)} texts to {target_language}")
+        return translated
+        
+    except Exception as e:
+        logger.error(f"Error translating texts: {e}")
+        return list(texts)
+
+
+def _translate_batch(texts: List[str], target_language: str) -> List[str]:
+    """
+    Translate a list of texts using the list form of the API, starting a new request
+    when the next text would take it past the character or segment limit
+    """
+    target_code = _LANGUAGE_CODES.get(target_language.lower(), target_language)
+    client = _get_translate_client()
+    
+    translated = []
+    batch, batch_chars = [], 0
+    for text in texts:
+        if batch and (batch_chars + len(text) > _MAX_REQUEST_CHARS or len(batch) == _MAX_TRANSLATE_SEGMENTS):
+            translated.extend(result["translatedText"] for result in client.translate(batch, target_language=target_code))
+            batch, batch_chars = [], 0
+        batch.append(text)
+        batch_chars += len(text)
+    
+    if batch:
+        translated.extend(result["translatedText"] for result in client.translate(batch, target_language=target_code))
+    return translated
+
+
+def _split_for_translation(text: str) -> List[Tuple[str, str]]:
+    """
+    Split text into (chunk, separator) pairs of at most _MAX_TRANSLATE_CHARS characters,
+    breaking at sentence or line ends; joining chunk + separator restores the text.
+    """
+    segments = []
+    pos = 0
+    for match in _CHUNK_BOUNDARY_RE.finditer(text):
+        segments.append((text[pos:match.start()], match.group()))
+        pos = match.end()
+    segments.append((text[pos:], ""))
+    
+    chunks = []
+    current, current_separator = None, ""
+    for segment, separator in segments:
+        # A single sentence over the limit has no better boundary, cut it at the limit
+        while len(segment) > _MAX_TRANSLATE_CHARS:
+            if current is not None:
+                chunks.append((current, current_separator))
+                current, current_separator = None, ""
+            chunks.append((segment[:_MAX_TRANSLATE_CHARS], ""))
+            segment = segment[_MAX_TRANSLATE_CHARS:]
+        
+        if current is None:
+            current = segment
+        elif len(current) + len(current_separator) + len(segment) > _MAX_TRANSLATE_CHARS:
+            chunks.append((current, current_separator))
+            current = segment
+        else:
+            current = current + current_separator + segment
+        current_separator = separator
+    
+    chunks.append((current, current_separator))
+    return chunks
@@ -1,85 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import importlib
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import user
-from app.routes import health
-from app.routes import agent
-from app.routes import session
-from app.routes import content
-from app.routes import content_analysis
-from app.routes import worksheet
-import os
-
-# Ensure all service singletons are initialized
-from app.services.main_agent_service import main_agent_service
-from app.services.hyper_local_content_service import hyper_local_content_service
-from app.services.visual_aids_service import visual_aids_service
-from app.services.content_generation_service import content_generation_service
-from app.services.worksheet_generator_service import worksheet_generator_service
 from app.utils.logger import logger
+import asyncio
+import os
 
-logger.info("All agent services initialized in main.py")
-
-app = FastAPI(
-    title="Sahayak - AI Teaching Assistant API",
-    description="""
-    Sahayak is an AI Teaching Assistant API designed for multi-grade, low-resource classrooms in India.
-    
-    ## Features
-    
-    * **AI Teaching Assistant**: Generate educational content in multiple Indian languages
-    * **Visual Aids**: Create educational images for teaching concepts
-    * **Hyper-local Content**: Generate culturally relevant educational material
-    * **Content Analysis**: Upload images or PDFs for automatic content generation
-    * **User Session Management**: Track and continue teaching sessions
-    * **Multimedia Support**: Process various media formats for content generation
-    * **Customizable Outputs**: Multiple format options for generated content
-    * **Multilingual Capabilities**: Support for major Indian languages
-    
-    This API provides a comprehensive suite of tools to assist teachers in creating,
-    customizing, and delivering educational content suited to diverse classroom needs.
-    """,
-    version="1.2.0"
+# Agent service modules whose singletons are built when the app is created
+_SERVICE_MODULES = (
+    "app.services.main_agent_service",
+    "app.services.hyper_local_content_service",
+    "app.services.visual_aids_service",
+    "app.services.content_generation_service",
+    "app.services.worksheet_generator_service",
 )
 
-# Create required directories for file storage
+# Directories for file storage, served by the static mounts below
 generated_images_dir = os.path.join(os.getcwd(), "generated_images")
 generated_pdfs_dir = os.path.join(os.getcwd(), "generated_pdfs")
 uploads_dir = os.path.join(os.getcwd(), "uploads")
-os.makedirs(generated_images_dir, exist_ok=True)
-os.makedirs(generated_pdfs_dir, exist_ok=True)
-os.makedirs(uploads_dir, exist_ok=True)
-
-# Add CORS middleware to allow requests from any origin
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # For development; restrict in production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-app.include_router(user.router, prefix="/user")
-app.include_router(health.router, prefix="/health")
-app.include_router(agent.router, prefix="/agent", tags=["AI Teaching Assistant"])
-app.include_router(session.router, prefix="/session", tags=["User Sessions"])
-app.include_router(content.router, tags=["Content Generation"])
-app.include_router(content_analysis.router, tags=["Content Analysis"])
-app.include_router(content_analysis.content_router, tags=["Simplified Content Generation"])
-app.include_router(worksheet.router, tags=["Educational Worksheets"])
-
-# Mount the static file directories for generated files
-app.mount("/generated_images", StaticFiles(directory="generated_images"), name="generated_images")
-app.mount("/generated_pdfs", StaticFiles(directory="generated_pdfs"), name="generated_pdfs")
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-
-# Create a static directory for other static assets if it doesn't exist
 static_dir = os.path.join(os.getcwd(), "static", "images")
-os.makedirs(static_dir, exist_ok=True)
-
-# Create a simple placeholder image if it doesn't exist
 placeholder_path = os.path.join(static_dir, "placeholder.png")
-if not os.path.exists(placeholder_path):
+
+
+def _ensure_placeholder():
+    """Create a simple placeholder image if it doesn't exist; PIL is only imported when needed"""
+    if os.path.exists(placeholder_path):
+        return
     try:
         from PIL import Image, ImageDraw, ImageFont
         image = Image.new('RGB', (800, 600), color=(240, 240, 240))
@@ -94,7 +43,102 @@ if not os.path.exists(placeholder_path):
     except Exception as e:
         logger.error(f"Failed to create placeholder image: {e}")
 
-# Mount the static directory
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+def _prepare_storage():
+    """Create required directories for file storage and the placeholder image"""
+    for directory in (generated_images_dir, generated_pdfs_dir, uploads_dir, static_dir):
+        os.makedirs(directory, exist_ok=True)
+    _ensure_placeholder()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Filesystem and PIL work runs off the event loop, once per worker before serving
+    await asyncio.to_thread(_prepare_storage)
+    
+    # Warm the async Gemini client on the serving loop without holding up startup
+    from app.services.worksheet_generator_service import worksheet_generator_service
+    model_warmup = asyncio.create_task(worksheet_generator_service.warmup_model())
+    yield
+    model_warmup.cancel()
+
+
+_API_DESCRIPTION = """
+    Sahayak is an AI Teaching Assistant API designed for multi-grade, low-resource classrooms in India.
+    
+    ## Features
+    
+    * **AI Teaching Assistant**: Generate educational content in multiple Indian languages
+    * **Visual Aids**: Create educational images for teaching concepts
+    * **Hyper-local Content**: Generate culturally relevant educational material
+    * **Content Analysis**: Upload images or PDFs for automatic content generation
+    * **User Session Management**: Track and continue teaching sessions
+    * **Multimedia Support**: Process various media formats for content generation
+    * **Customizable Outputs**: Multiple format options for generated content
+    * **Multilingual Capabilities**: Support for major Indian languages
+    
+    This API provides a comprehensive suite of tools to assist teachers in creating,
+    customizing, and delivering educational content suited to diverse classroom needs.
+    """
+
+
+def _init_services():
+    """Initialize the agent service singletons concurrently so their client setup overlaps"""
+    with ThreadPoolExecutor(max_workers=len(_SERVICE_MODULES), thread_name_prefix="service-init") as pool:
+        list(pool.map(importlib.import_module, _SERVICE_MODULES))
+    logger.info("All agent services initialized in main.py")
+
+
+def create_app() -> FastAPI:
+    """Build the API application: services, routers and static mounts"""
+    _init_services()
+    
+    app = FastAPI(
+        title="Sahayak - AI Teaching Assistant API",
+        description=_API_DESCRIPTION,
+        version="1.2.0",
+        lifespan=lifespan
+    )
+
+    # Add CORS middleware to allow requests from any origin
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # For development; restrict in production
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Routers pull in the service modules, import them only when building the app
+    from app.routes import user
+    from app.routes import health
+    from app.routes import agent
+    from app.routes import session
+    from app.routes import content
+    from app.routes import content_analysis
+    from app.routes import worksheet
+    
+    app.include_router(user.router, prefix="/user")
+    app.include_router(health.router, prefix="/health")
+    app.include_router(agent.router, prefix="/agent", tags=["AI Teaching Assistant"])
+    app.include_router(session.router, prefix="/session", tags=["User Sessions"])
+    app.include_router(content.router, tags=["Content Generation"])
+    app.include_router(content_analysis.router, tags=["Content Analysis"])
+    app.include_router(content_analysis.content_router, tags=["Simplified Content Generation"])
+    app.include_router(worksheet.router, tags=["Educational Worksheets"])
+
+    # Mount the static file directories for generated files; the directories are created in lifespan
+    app.mount("/generated_images", StaticFiles(directory="generated_images", check_dir=False), name="generated_images")
+    app.mount("/generated_pdfs", StaticFiles(directory="generated_pdfs", check_dir=False), name="generated_pdfs")
+    app.mount("/uploads", StaticFiles(directory="uploads", check_dir=False), name="uploads")
+
+    # Mount the static directory
+    app.mount("/static", StaticFiles(directory="static", check_dir=False), name="static")
+    
+    return app
+
+
+# The app is built by the server through the factory (see the Dockerfile CMD), so importing
+# main doesn't import any router or service. Run locally with: uvicorn --factory main:create_app
 
 # No need for uvicorn.run() in production, App Engine handles this.